@@ -0,0 +1,202 @@
+import asyncio
+import hashlib
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import aiohttp
+
+from metrics import track
+from pinata import PINATA_GATEWAY_URL
+
+# Total size of the avatar images kept on disk (bytes)
+AVATAR_STORE_MAX_BYTES = int(os.getenv("AVATAR_STORE_MAX_BYTES", str(1024**3)))
+
+# Largest image fetched from a gateway (bytes)
+AVATAR_MAX_FETCH_SIZE = 20 * 1024 * 1024
+
+# Total time allowed to fetch an image from a gateway (seconds)
+AVATAR_FETCH_TIMEOUT = 30.0
+
+AVATAR_FETCH_CHUNK_SIZE = 64 * 1024
+
+# Avatar of the usernames without one, followed by the username
+AVATAR_FALLBACK_URL = "https://avatars.jakerunzer.com"
+
+# Only images under these URLs are fetched and served by the backend. Avatar text
+# records can be set to any URL, internal hosts included.
+PROXIED_URL_PREFIXES = (f"{PINATA_GATEWAY_URL}/", f"{AVATAR_FALLBACK_URL}/")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS avatars (
+    key TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    content_type TEXT NOT NULL,
+    etag TEXT NOT NULL,
+    accessed REAL NOT NULL
+);
+"""
+
+
+def is_proxied(url: str) -> bool:
+    """Whether the image at `url` may be fetched and served by the backend"""
+    return url.startswith(PROXIED_URL_PREFIXES)
+
+
+@dataclass
+class StoredAvatar:
+    path: str
+    size: int
+    content_type: str
+    etag: str
+
+
+def cache_key(url: str) -> str:
+    """The CID path of IPFS gateway URLs, the URL itself for any other image"""
+    prefix = f"{PINATA_GATEWAY_URL}/"
+    return url.removeprefix(prefix) if url.startswith(prefix) else url
+
+
+class AvatarStore:
+    """
+    Avatar images on disk, evicted least recently used first once they take more
+    than `max_bytes`. Their metadata and last access time are kept in SQLite so
+    the store survives restarts.
+    """
+
+    def __init__(self, directory: str, conn: sqlite3.Connection, max_bytes: int):
+        self.directory = directory
+        self.conn = conn
+        self.max_bytes = max_bytes
+        self.size = 0
+        os.makedirs(directory, exist_ok=True)
+        self.conn.executescript(SCHEMA)
+        self._entries: OrderedDict[str, StoredAvatar] = OrderedDict()
+        for key, size, content_type, etag in self.conn.execute(
+            "SELECT key, size, content_type, etag FROM avatars ORDER BY accessed"
+        ):
+            self._entries[key] = StoredAvatar(self.path(key), size, content_type, etag)
+            self.size += size
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, hashlib.sha256(key.encode()).hexdigest())
+
+    def get(self, key: str) -> StoredAvatar | None:
+        stored = self._entries.get(key)
+        if stored is None:
+            return None
+        self._entries.move_to_end(key)
+        with self.conn:
+            self.conn.execute(
+                "UPDATE avatars SET accessed = ? WHERE key = ?", (time.time(), key)
+            )
+        return stored
+
+    def put(self, key: str, file: str, content_type: str, etag: str) -> StoredAvatar:
+        """Move the downloaded `file` into the store"""
+        stored = StoredAvatar(self.path(key), os.path.getsize(file), content_type, etag)
+        os.replace(file, stored.path)
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self.size -= previous.size
+        self._entries[key] = stored
+        self.size += stored.size
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO avatars VALUES (?, ?, ?, ?, ?)",
+                (key, stored.size, content_type, etag, time.time()),
+            )
+        self._evict()
+        return stored
+
+    def _evict(self) -> None:
+        # The entry just added is never evicted, even when larger than the store
+        while self.size > self.max_bytes and len(self._entries) > 1:
+            key, stored = self._entries.popitem(last=False)
+            self.size -= stored.size
+            try:
+                os.remove(stored.path)
+            except FileNotFoundError:
+                pass
+            with self.conn:
+                self.conn.execute("DELETE FROM avatars WHERE key = ?", (key,))
+
+
+class AvatarFetcher:
+    """
+    Serves avatar images from the store, downloading the missing ones.
+
+    Concurrent requests for an image being downloaded wait for the same
+    download. Images from the IPFS gateway are immutable, their CID path is used
+    as ETag; other images get the hash of their content.
+    """
+
+    def __init__(self, store: AvatarStore) -> None:
+        self.store = store
+        self._session: aiohttp.ClientSession | None = None
+        self._downloads: dict[str, asyncio.Task[StoredAvatar]] = {}
+
+    def start(self) -> None:
+        """Open the HTTP session, must be called from the running event loop"""
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=AVATAR_FETCH_TIMEOUT)
+            )
+
+    async def stop(self) -> None:
+        for task in list(self._downloads.values()):
+            task.cancel()
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def get(self, url: str) -> StoredAvatar:
+        if not is_proxied(url):
+            raise ValueError(f"Avatar URL not proxied: {url}")
+        key = cache_key(url)
+        stored = self.store.get(key)
+        if stored is not None:
+            return stored
+
+        task = self._downloads.get(key)
+        if task is None:
+            task = asyncio.create_task(self._download(key, url))
+            self._downloads[key] = task
+            task.add_done_callback(lambda _: self._downloads.pop(key, None))
+        # A client going away must not cancel the download for the others
+        return await asyncio.shield(task)
+
+    async def _download(self, key: str, url: str) -> StoredAvatar:
+        if self._session is None:
+            raise RuntimeError("Avatar fetcher is not started")
+
+        file = f"{self.store.path(key)}.part"
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with track("gateway", "fetch"):
+                async with self._session.get(url) as response:
+                    response.raise_for_status()
+                    content_type = response.headers.get(
+                        "Content-Type", "application/octet-stream"
+                    )
+                    with open(file, "wb") as output:
+                        async for chunk in response.content.iter_chunked(
+                            AVATAR_FETCH_CHUNK_SIZE
+                        ):
+                            size += len(chunk)
+                            if size > AVATAR_MAX_FETCH_SIZE:
+                                raise ValueError(f"Avatar at {url} is too large")
+                            digest.update(chunk)
+                            await asyncio.to_thread(output.write, chunk)
+        except BaseException:
+            try:
+                os.remove(file)
+            except FileNotFoundError:
+                pass
+            raise
+
+        etag = key if key != url else digest.hexdigest()
+        return self.store.put(key, file, content_type, f'"{etag}"')
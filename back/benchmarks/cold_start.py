@@ -0,0 +1,125 @@
+"""
+Cold start benchmark of the backend.
+
+Measures, each in a fresh interpreter:
+
+- import time: how long `import main` takes
+- time to first response: from launching uvicorn to the first answered request,
+  which includes the interpreter start, the import and the application startup
+
+Usage, from the `back` directory:
+
+    python benchmarks/cold_start.py [--runs 5] [--path /cache/stats]
+
+The configuration is read from the environment like the application does. A
+throwaway signer key and a temporary data directory are used when none is set.
+"""
+
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+BACK_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Give up on a server that has not answered after this long (seconds)
+STARTUP_TIMEOUT = 60.0
+
+# Delay between two attempts to reach the server (seconds)
+POLL_INTERVAL = 0.01
+
+IMPORT_SCRIPT = """
+import time
+started = time.perf_counter()
+import main
+print(time.perf_counter() - started)
+"""
+
+
+def measure_import(env: dict[str, str]) -> float:
+    output = subprocess.run(
+        [sys.executable, "-c", IMPORT_SCRIPT],
+        cwd=BACK_DIR,
+        env=env,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def measure_first_response(env: dict[str, str], path: str) -> float:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "main:app",
+            "--port",
+            str(port),
+            "--log-level",
+            "warning",
+        ],
+        cwd=BACK_DIR,
+        env=env,
+        # Background tasks may log errors when no RPC endpoint is reachable
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        while time.perf_counter() - started < STARTUP_TIMEOUT:
+            if server.poll() is not None:
+                raise RuntimeError("The server exited during startup")
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}{path}"):
+                    return time.perf_counter() - started
+            except urllib.error.HTTPError:
+                # Any answer counts, even an error one
+                return time.perf_counter() - started
+            except OSError:
+                time.sleep(POLL_INTERVAL)
+        raise TimeoutError(f"No response after {STARTUP_TIMEOUT}s")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def summary(name: str, samples: list[float]) -> str:
+    return (
+        f"{name}: median {statistics.median(samples) * 1000:.0f} ms, "
+        f"min {min(samples) * 1000:.0f} ms, max {max(samples) * 1000:.0f} ms"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--path", default="/cache/stats")
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env.setdefault("BEDROCK_PRIVATE_KEY", "0x" + "11" * 32)
+    with tempfile.TemporaryDirectory() as data_dir:
+        env.setdefault("DATA_DIR", data_dir)
+        imports = [measure_import(env) for _ in range(args.runs)]
+        first_responses = [
+            measure_first_response(env, args.path) for _ in range(args.runs)
+        ]
+
+    print(summary("import time", imports))
+    print(summary("time to first response", first_responses))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,379 @@
+"""
+Load test of the backend against local stand-ins for its dependencies.
+
+Starts the mock chain, Aleph and Pinata services of `benchmarks/mocks.py`, then
+the application with uvicorn pointed at them, and drives it with a weighted mix
+of requests from concurrent clients for a fixed duration. Reports, per kind of
+request and overall, the throughput and the p50/p95/p99 latencies.
+
+Usage, from the `back` directory:
+
+    python benchmarks/load_test.py [--mix mixed] [--duration 30] \
+        [--concurrency 32] [--rpc-latency 20] [--output results.json]
+
+Mixes: read (lookups and balances only), mixed (mostly reads with some
+registrations and payments) and write (registrations and payments only).
+"""
+
+import argparse
+import asyncio
+import hashlib
+import hmac
+import itertools
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from typing import Any
+
+import aiohttp
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from mocks import SEEDED_USERS, START_BLOCK, seeded_address  # noqa: E402
+
+BACK_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Give up on services that have not answered after this long (seconds)
+STARTUP_TIMEOUT = 60.0
+
+# Delay between two attempts to reach a starting service (seconds)
+POLL_INTERVAL = 0.05
+
+# Throwaway configuration of the application under test
+SIGNER_KEY = "0x" + "11" * 32
+WEBHOOK_SECRET = "load-test-secret"
+PAYMENT_PROCESSOR_ADDRESS = "0x" + "50" * 20
+
+# Relative weights of the requests of each mix
+MIXES: dict[str, dict[str, int]] = {
+    "read": {"available": 40, "username": 40, "credits": 20},
+    "mixed": {
+        "available": 30,
+        "username": 30,
+        "credits": 20,
+        "register": 10,
+        "webhook": 10,
+    },
+    "write": {"register": 50, "webhook": 50},
+}
+
+
+@dataclass
+class Call:
+    method: str
+    path: str
+    body: bytes | None = None
+    headers: dict[str, str] = field(default_factory=dict)
+
+
+def json_call(method: str, path: str, payload: Any) -> Call:
+    return Call(
+        method,
+        path,
+        json.dumps(payload).encode(),
+        {"Content-Type": "application/json"},
+    )
+
+
+class Scenarios:
+    """Requests of every kind, with realistic arguments"""
+
+    def __init__(self, seeded_users: int) -> None:
+        self.seeded_users = seeded_users
+        self.addresses = [seeded_address(i) for i in range(seeded_users)]
+        self._sequence = itertools.count()
+
+    def available(self, rng: random.Random) -> Call:
+        # Half of the usernames checked are already taken
+        return Call(
+            "GET", f"/available?username=user{rng.randrange(2 * self.seeded_users)}"
+        )
+
+    def username(self, rng: random.Random) -> Call:
+        return Call("GET", f"/{rng.choice(self.addresses)}")
+
+    def credits(self, rng: random.Random) -> Call:
+        return Call("GET", f"/credits/{rng.choice(self.addresses)}")
+
+    def register(self, rng: random.Random) -> Call:
+        return json_call(
+            "POST",
+            "/register",
+            {
+                "username": f"bench{next(self._sequence)}",
+                "address": "0x" + rng.randbytes(20).hex(),
+            },
+        )
+
+    def webhook(self, rng: random.Random) -> Call:
+        cents = rng.randrange(100, 10_000)
+        details = {
+            "transactionHash": "0x" + rng.randbytes(32).hex(),
+            "amountWei": str(cents * 10**16),
+            "amount": str(cents / 100),
+            "amountUSDCents": cents,
+            "completedAt": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        }
+        body = json.dumps(
+            {
+                "data": {
+                    "buyWithCryptoStatus": {
+                        "swapType": "SAME_CHAIN",
+                        "source": details,
+                        "status": "COMPLETED",
+                        "toAddress": PAYMENT_PROCESSOR_ADDRESS,
+                        "destination": details,
+                        "purchaseData": {"userAddress": rng.choice(self.addresses)},
+                    }
+                }
+            }
+        ).encode()
+        timestamp = str(int(time.time()))
+        signature = hmac.new(
+            WEBHOOK_SECRET.encode(), timestamp.encode() + b"." + body, hashlib.sha256
+        ).hexdigest()
+        return Call(
+            "POST",
+            "/thirdweb/webhook",
+            body,
+            {
+                "Content-Type": "application/json",
+                "X-Pay-Signature": signature,
+                "X-Pay-Timestamp": timestamp,
+            },
+        )
+
+
+@dataclass
+class Results:
+    # Latencies of the answered requests and number of errors, per scenario
+    latencies: dict[str, list[float]] = field(default_factory=dict)
+    errors: dict[str, int] = field(default_factory=dict)
+
+    def record(self, scenario: str, latency: float, error: bool) -> None:
+        self.latencies.setdefault(scenario, []).append(latency)
+        if error:
+            self.errors[scenario] = self.errors.get(scenario, 0) + 1
+
+
+async def client(
+    session: aiohttp.ClientSession,
+    base_url: str,
+    mix: dict[str, int],
+    scenarios: Scenarios,
+    rng: random.Random,
+    results: Results,
+    record_from: float,
+    deadline: float,
+) -> None:
+    names = list(mix)
+    weights = list(mix.values())
+    builders: dict[str, Callable[[random.Random], Call]] = {
+        name: getattr(scenarios, name) for name in names
+    }
+    while time.perf_counter() < deadline:
+        scenario = rng.choices(names, weights)[0]
+        call = builders[scenario](rng)
+        started = time.perf_counter()
+        try:
+            async with session.request(
+                call.method, base_url + call.path, data=call.body, headers=call.headers
+            ) as response:
+                await response.read()
+                error = response.status >= 400
+        except aiohttp.ClientError:
+            error = True
+        if started >= record_from:
+            results.record(scenario, time.perf_counter() - started, error)
+
+
+def percentile(samples: list[float], fraction: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def summarize(results: Results, duration: float) -> dict[str, dict[str, float]]:
+    series = dict(results.latencies)
+    series["total"] = [x for samples in results.latencies.values() for x in samples]
+    errors = dict(results.errors, total=sum(results.errors.values()))
+    return {
+        name: {
+            "requests": len(samples),
+            "errors": errors.get(name, 0),
+            "throughput": len(samples) / duration,
+            "mean_ms": statistics.fmean(samples) * 1000,
+            "p50_ms": percentile(samples, 0.50) * 1000,
+            "p95_ms": percentile(samples, 0.95) * 1000,
+            "p99_ms": percentile(samples, 0.99) * 1000,
+        }
+        for name, samples in series.items()
+        if samples
+    }
+
+
+def print_summary(summary: dict[str, dict[str, float]]) -> None:
+    print(
+        f"{'scenario':<12}{'requests':>10}{'errors':>8}{'req/s':>10}"
+        f"{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+    )
+    for name, stats in summary.items():
+        print(
+            f"{name:<12}{stats['requests']:>10}{stats['errors']:>8}"
+            f"{stats['throughput']:>10.1f}{stats['p50_ms']:>10.1f}"
+            f"{stats['p95_ms']:>10.1f}{stats['p99_ms']:>10.1f}"
+        )
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port: int, process: subprocess.Popen) -> None:
+    started = time.perf_counter()
+    while time.perf_counter() - started < STARTUP_TIMEOUT:
+        if process.poll() is not None:
+            raise RuntimeError(f"{process.args!r} exited during startup")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                return
+        except OSError:
+            time.sleep(POLL_INTERVAL)
+    raise TimeoutError(f"Nothing listening on port {port} after {STARTUP_TIMEOUT}s")
+
+
+async def run(args: argparse.Namespace, base_url: str) -> dict[str, dict[str, float]]:
+    scenarios = Scenarios(args.seeded_users)
+    results = Results()
+    started = time.perf_counter()
+    record_from = started + args.warmup
+    deadline = record_from + args.duration
+    async with aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=args.concurrency),
+        timeout=aiohttp.ClientTimeout(total=60),
+    ) as session:
+        await asyncio.gather(
+            *(
+                client(
+                    session,
+                    base_url,
+                    MIXES[args.mix],
+                    scenarios,
+                    random.Random(f"{args.seed}-{i}"),
+                    results,
+                    record_from,
+                    deadline,
+                )
+                for i in range(args.concurrency)
+            )
+        )
+    return summarize(results, args.duration)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--mix", choices=MIXES, default="mixed")
+    parser.add_argument("--duration", type=float, default=30, help="s")
+    parser.add_argument(
+        "--warmup", type=float, default=5, help="s, not counted in the results"
+    )
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--seed", default="0")
+    parser.add_argument("--seeded-users", type=int, default=SEEDED_USERS)
+    parser.add_argument("--rpc-latency", type=float, default=20, help="ms")
+    parser.add_argument("--aleph-latency", type=float, default=80, help="ms")
+    parser.add_argument("--pinata-latency", type=float, default=300, help="ms")
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    parser.add_argument(
+        "--verbose", action="store_true", help="show the output of the services"
+    )
+    args = parser.parse_args()
+
+    output = None if args.verbose else subprocess.DEVNULL
+    rpc_port, aleph_port, pinata_port, app_port = (free_port() for _ in range(4))
+    processes: list[subprocess.Popen] = []
+    with tempfile.TemporaryDirectory() as data_dir:
+        try:
+            mocks = subprocess.Popen(
+                [
+                    sys.executable,
+                    os.path.join(BACK_DIR, "benchmarks", "mocks.py"),
+                    f"--rpc-port={rpc_port}",
+                    f"--aleph-port={aleph_port}",
+                    f"--pinata-port={pinata_port}",
+                    f"--rpc-latency={args.rpc_latency}",
+                    f"--aleph-latency={args.aleph_latency}",
+                    f"--pinata-latency={args.pinata_latency}",
+                    f"--seeded-users={args.seeded_users}",
+                ],
+                cwd=BACK_DIR,
+                stdout=output,
+                stderr=output,
+            )
+            processes.append(mocks)
+            for port in (rpc_port, aleph_port, pinata_port):
+                wait_for_port(port, mocks)
+
+            env = dict(
+                os.environ,
+                BEDROCK_PRIVATE_KEY=SIGNER_KEY,
+                ALEPH_PRIVATE_KEY=SIGNER_KEY,
+                BASE_RPC_URL=f"http://127.0.0.1:{rpc_port}",
+                ALEPH_API_HOST=f"http://127.0.0.1:{aleph_port}",
+                PINATA_API_URL=f"http://127.0.0.1:{pinata_port}",
+                PINATA_JWT="load-test",
+                THIRDWEB_WEBHOOK_SECRET=WEBHOOK_SECRET,
+                PAYMENT_PROCESSOR_ADDRESS=PAYMENT_PROCESSOR_ADDRESS,
+                DATA_DIR=data_dir,
+                INDEXER_START_BLOCK=str(START_BLOCK),
+            )
+            app = subprocess.Popen(
+                [
+                    sys.executable,
+                    "-m",
+                    "uvicorn",
+                    "main:app",
+                    "--port",
+                    str(app_port),
+                    "--log-level",
+                    "warning",
+                    "--no-access-log",
+                ],
+                cwd=BACK_DIR,
+                env=env,
+                stdout=output,
+                stderr=output,
+            )
+            processes.append(app)
+            wait_for_port(app_port, app)
+
+            summary = asyncio.run(run(args, f"http://127.0.0.1:{app_port}"))
+        finally:
+            for process in reversed(processes):
+                process.terminate()
+                process.wait()
+
+    print(
+        f"mix {args.mix}, {args.concurrency} clients, {args.duration:.0f} s, "
+        f"latencies rpc {args.rpc_latency:.0f} ms, aleph {args.aleph_latency:.0f} ms, "
+        f"pinata {args.pinata_latency:.0f} ms"
+    )
+    print_summary(summary)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(
+                {"arguments": vars(args), "results": summary}, output_file, indent=2
+            )
+
+
+if __name__ == "__main__":
+    main()
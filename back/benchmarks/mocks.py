@@ -0,0 +1,332 @@
+"""
+Local stand-ins for the services the backend depends on, for benchmarks:
+
+- a JSON-RPC node emulating the registrar, the registry and Multicall3, mining
+  the transactions it receives as soon as they are sent
+- the Aleph aggregate API, merging the aggregates it receives
+- the Pinata pinning API
+
+Every service answers after a configurable latency. Usage, from the `back`
+directory:
+
+    python benchmarks/mocks.py --rpc-port 8545 --aleph-port 8546 \
+        --pinata-port 8547 [--rpc-latency 20] [--aleph-latency 80] ...
+
+Point the backend at them with BASE_RPC_URL, ALEPH_API_HOST and PINATA_API_URL.
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import sys
+import time
+from typing import Any
+
+from aiohttp import web
+from eth_abi import decode, encode
+from eth_account.typed_transactions import TypedTransaction
+from eth_utils import function_signature_to_4byte_selector, keccak, to_checksum_address
+from hexbytes import HexBytes
+
+BACK_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACK_DIR)
+
+from ipfs import file_cid  # noqa: E402
+from main import (  # noqa: E402
+    REGISTRAR_CONTRACT_ADDRESS,
+    REGISTRY_CONTRACT_ADDRESS,
+    namehash,
+)
+from multicall import MULTICALL3_ADDRESS  # noqa: E402
+
+CHAIN_ID = 8453
+
+# Block the emulated chain starts at, and the time between two blocks (seconds)
+START_BLOCK = 30_000_000
+BLOCK_TIME = 2.0
+
+BASE_FEE = 10**7
+PRIORITY_FEE = 10**6
+GAS_USED = 150_000
+
+# Usernames registered before the benchmark starts: user0, user1...
+SEEDED_USERS = 10_000
+
+REGISTRAR = REGISTRAR_CONTRACT_ADDRESS.lower()
+REGISTRY = REGISTRY_CONTRACT_ADDRESS.lower()
+MULTICALL = MULTICALL3_ADDRESS.lower()
+
+ZERO_ADDRESS = "0x" + "00" * 20
+
+
+def selector(signature: str) -> bytes:
+    return function_signature_to_4byte_selector(signature)
+
+
+AVAILABLE = selector("available(string)")
+GET_USERNAME = selector("getUsername(address)")
+REGISTER = selector("register(string,address)")
+SET_TEXT = selector("setText(bytes32,string,string)")
+ADDR = selector("addr(bytes32)")
+TEXT = selector("text(bytes32,string)")
+AGGREGATE3 = selector("aggregate3((address,bool,bytes)[])")
+
+
+def seeded_username(i: int) -> str:
+    return f"user{i}"
+
+
+def seeded_address(i: int) -> str:
+    """Address the seeded username `i` is registered to"""
+    return to_checksum_address(keccak(text=seeded_username(i))[-20:])
+
+
+def node_of(username: str) -> bytes:
+    return namehash(f"{username}.bedrock-app.eth")
+
+
+class Chain:
+    """Names, text records and transactions of the emulated chain"""
+
+    def __init__(self, seeded_users: int) -> None:
+        self.started = time.monotonic()
+        self.addresses: dict[bytes, str] = {}
+        self.usernames: dict[str, str] = {}
+        self.texts: dict[tuple[bytes, str], str] = {}
+        self.receipts: dict[str, dict[str, Any]] = {}
+        # Next nonce of the backend signer, the only sender
+        self.nonce = 0
+        for i in range(seeded_users):
+            self.add_name(seeded_username(i), seeded_address(i))
+
+    @property
+    def block_number(self) -> int:
+        return START_BLOCK + int((time.monotonic() - self.started) / BLOCK_TIME)
+
+    def add_name(self, username: str, address: str) -> None:
+        self.addresses[node_of(username)] = address.lower()
+        self.usernames[address.lower()] = username
+
+    def call(self, to: str, data: bytes) -> bytes:
+        function, args = data[:4], data[4:]
+        if to == MULTICALL and function == AGGREGATE3:
+            (calls,) = decode(["(address,bool,bytes)[]"], args)
+            results = []
+            for target, allow_failure, call_data in calls:
+                try:
+                    results.append((True, self.call(target.lower(), call_data)))
+                except ValueError:
+                    if not allow_failure:
+                        raise
+                    results.append((False, b""))
+            return encode(["(bool,bytes)[]"], [results])
+        if to == REGISTRAR and function == AVAILABLE:
+            (username,) = decode(["string"], args)
+            return encode(["bool"], [node_of(username) not in self.addresses])
+        if to == REGISTRAR and function == GET_USERNAME:
+            (address,) = decode(["address"], args)
+            return encode(["string"], [self.usernames.get(address.lower(), "")])
+        if to == REGISTRY and function == ADDR:
+            (node,) = decode(["bytes32"], args)
+            return encode(["address"], [self.addresses.get(node, ZERO_ADDRESS)])
+        if to == REGISTRY and function == TEXT:
+            node, key = decode(["bytes32", "string"], args)
+            return encode(["string"], [self.texts.get((node, key), "")])
+        raise ValueError(f"Unknown call to {to}")
+
+    def send(self, raw_transaction: str) -> str:
+        """Mine the transaction right away in the current block"""
+        transaction = TypedTransaction.from_bytes(HexBytes(raw_transaction))
+        # Hash of the signed transaction, `transaction.hash()` is the signing hash
+        tx_hash = "0x" + keccak(HexBytes(raw_transaction)).hex()
+        fields = transaction.as_dict()
+        self.nonce = max(self.nonce, fields["nonce"] + 1)
+
+        data = bytes(fields["data"])
+        status = 1
+        try:
+            if data[:4] == REGISTER:
+                username, address = decode(["string", "address"], data[4:])
+                self.add_name(username, address)
+            elif data[:4] == SET_TEXT:
+                node, key, value = decode(["bytes32", "string", "string"], data[4:])
+                self.texts[(node, key)] = value
+        except Exception:
+            status = 0
+        self.receipts[tx_hash] = {
+            "transactionHash": tx_hash,
+            "blockNumber": hex(self.block_number),
+            "gasUsed": hex(GAS_USED),
+            "status": hex(status),
+        }
+        return tx_hash
+
+    def handle(self, request: dict[str, Any]) -> dict[str, Any]:
+        method, params = request["method"], request.get("params") or []
+        try:
+            result = self._result(method, params)
+        except Exception as e:
+            return {
+                "jsonrpc": "2.0",
+                "id": request.get("id"),
+                "error": {"code": -32000, "message": str(e)},
+            }
+        return {"jsonrpc": "2.0", "id": request.get("id"), "result": result}
+
+    def _result(self, method: str, params: list[Any]) -> Any:
+        if method == "eth_chainId":
+            return hex(CHAIN_ID)
+        if method == "eth_blockNumber":
+            return hex(self.block_number)
+        if method == "eth_getBlockByNumber":
+            return {
+                "number": hex(self.block_number),
+                "baseFeePerGas": hex(BASE_FEE),
+            }
+        if method == "eth_maxPriorityFeePerGas":
+            return hex(PRIORITY_FEE)
+        if method == "eth_getTransactionCount":
+            # Every transaction is mined as soon as it is received
+            return hex(self.nonce)
+        if method == "eth_call":
+            call = params[0]
+            data = call.get("data") or call.get("input") or "0x"
+            return "0x" + self.call(call["to"].lower(), HexBytes(data)).hex()
+        if method == "eth_sendRawTransaction":
+            return self.send(params[0])
+        if method == "eth_getTransactionReceipt":
+            return self.receipts.get(params[0])
+        if method == "eth_getLogs":
+            # The seeded names predate the indexed blocks
+            return []
+        if method == "eth_getCode":
+            return "0x00"
+        raise ValueError(f"Unsupported method {method}")
+
+
+def delayed(latency: float) -> Any:
+    @web.middleware
+    async def middleware(request: web.Request, handler: Any) -> web.StreamResponse:
+        if latency:
+            await asyncio.sleep(latency)
+        return await handler(request)
+
+    return middleware
+
+
+def chain_app(latency: float, seeded_users: int = SEEDED_USERS) -> web.Application:
+    chain = Chain(seeded_users)
+
+    async def rpc(request: web.Request) -> web.Response:
+        body = await request.json()
+        if isinstance(body, list):
+            return web.json_response([chain.handle(r) for r in body])
+        return web.json_response(chain.handle(body))
+
+    app = web.Application(middlewares=[delayed(latency)])
+    app.router.add_post("/", rpc)
+    return app
+
+
+def aleph_app(latency: float) -> web.Application:
+    # Aggregates by address then key
+    aggregates: dict[str, dict[str, dict[str, Any]]] = {}
+
+    async def fetch_aggregate(request: web.Request) -> web.Response:
+        address = request.match_info["address"]
+        if address not in aggregates:
+            raise web.HTTPNotFound()
+        keys = request.query.get("keys")
+        data = aggregates[address]
+        if keys:
+            data = {key: data[key] for key in keys.split(",") if key in data}
+        return web.json_response({"address": address, "data": data})
+
+    async def post_message(request: web.Request) -> web.Response:
+        message = (await request.json())["message"]
+        if message["type"] == "AGGREGATE":
+            content = json.loads(message["item_content"])
+            # Aggregates are merged key by key with what was posted before
+            aggregates.setdefault(content["address"], {}).setdefault(
+                content["key"], {}
+            ).update(content["content"])
+        return web.json_response(
+            {
+                "publication_status": {"status": "success", "failed": []},
+                "message_status": "processed",
+            }
+        )
+
+    app = web.Application(middlewares=[delayed(latency)])
+    app.router.add_get("/api/v0/aggregates/{address}.json", fetch_aggregate)
+    app.router.add_post("/api/v0/messages", post_message)
+    return app
+
+
+def pinata_app(latency: float) -> web.Application:
+    async def pin_file(request: web.Request) -> web.Response:
+        content = io.BytesIO()
+        async for part in await request.multipart():
+            content.write(await part.read())  # type: ignore[union-attr]
+        content.seek(0)
+        return web.json_response(
+            {
+                "IpfsHash": file_cid(content),
+                "PinSize": content.getbuffer().nbytes,
+                "Timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            }
+        )
+
+    app = web.Application(
+        middlewares=[delayed(latency)], client_max_size=64 * 1024 * 1024
+    )
+    app.router.add_post("/pinning/pinFileToIPFS", pin_file)
+    return app
+
+
+async def serve(apps: list[tuple[web.Application, int]]) -> None:
+    runners = []
+    for app, port in apps:
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", port).start()
+        runners.append(runner)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        for runner in runners:
+            await runner.cleanup()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rpc-port", type=int, default=8545)
+    parser.add_argument("--aleph-port", type=int, default=8546)
+    parser.add_argument("--pinata-port", type=int, default=8547)
+    parser.add_argument("--rpc-latency", type=float, default=20, help="ms")
+    parser.add_argument("--aleph-latency", type=float, default=80, help="ms")
+    parser.add_argument("--pinata-latency", type=float, default=300, help="ms")
+    parser.add_argument("--seeded-users", type=int, default=SEEDED_USERS)
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(
+            serve(
+                [
+                    (
+                        chain_app(args.rpc_latency / 1000, args.seeded_users),
+                        args.rpc_port,
+                    ),
+                    (aleph_app(args.aleph_latency / 1000), args.aleph_port),
+                    (pinata_app(args.pinata_latency / 1000), args.pinata_port),
+                ]
+            )
+        )
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
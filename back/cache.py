@@ -0,0 +1,92 @@
+import time
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable, Hashable, Sequence
+from typing import Any, TypeVar
+
+T = TypeVar("T")
+K = TypeVar("K", bound=Hashable)
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    In-memory cache with a time-to-live per entry and LRU eviction.
+
+    Once `max_size` entries are stored, adding a new one evicts the least recently
+    used entry. Hits and misses are counted so the cache efficiency can be exposed.
+    Loaders returning `None` signal a failed lookup, which is never cached.
+    """
+
+    def __init__(self, ttl: float, max_size: int) -> None:
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return default
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key: Hashable, value: Any) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key: Hashable) -> None:
+        self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    async def get_or_load(self, key: Hashable, loader: Callable[[], Awaitable[T]]) -> T:
+        """Return the cached value for `key`, calling `loader` to fill it on a miss"""
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = await loader()
+            if value is not None:
+                self.set(key, value)
+        return value
+
+    async def get_or_load_many(
+        self,
+        keys: Sequence[K],
+        loader: Callable[[list[K]], Awaitable[Sequence[Any]]],
+    ) -> dict[K, Any]:
+        """Same as `get_or_load` for many keys, missing ones are loaded in one call"""
+        values: dict[K, Any] = {}
+        missing = []
+        for key in keys:
+            value = self.get(key, _MISSING)
+            if value is _MISSING:
+                missing.append(key)
+            else:
+                values[key] = value
+
+        if missing:
+            for key, value in zip(missing, await loader(missing)):
+                if value is not None:
+                    self.set(key, value)
+                values[key] = value
+        return values
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._entries),
+            "max_size": self.max_size,
+        }
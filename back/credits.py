@@ -0,0 +1,428 @@
+import asyncio
+import os
+import sqlite3
+import time
+from collections.abc import AsyncIterator, Sequence
+from functools import cache
+from typing import TYPE_CHECKING, cast
+
+import aiohttp
+from dotenv import load_dotenv
+
+from events import Broadcaster, format_event
+from metrics import track
+
+if TYPE_CHECKING:
+    from aleph.sdk import AuthenticatedAlephHttpClient
+    from aleph.sdk.chains.ethereum import ETHAccount
+
+load_dotenv()
+
+ALEPH_PRIVATE_KEY: bytes = os.getenv(  # type: ignore
+    "ALEPH_PRIVATE_KEY",
+    os.getenv("BEDROCK_PRIVATE_KEY"),  # type: ignore
+)
+
+# Aggregate that held every balance before they were split into shards
+CREDIT_BALANCES_KEY = "BEDROCK_CREDIT_BALANCES"
+
+# Balances are spread over 256 aggregate keys by the first byte of the address
+CREDIT_SHARD_KEYS = [f"{CREDIT_BALANCES_KEY}_{i:02x}" for i in range(256)]
+
+# How long a downloaded shard is served before being downloaded again in the
+# background (seconds)
+CREDITS_REFRESH_INTERVAL = float(os.getenv("CREDITS_REFRESH_INTERVAL", "10"))
+
+# Time allowed to a single request to Aleph (seconds)
+CREDITS_TIMEOUT = 30.0
+
+# Changed balances are published to Aleph together, at most this long after
+# changing (seconds) or as soon as this many are waiting
+CREDITS_FLUSH_INTERVAL = float(os.getenv("CREDITS_FLUSH_INTERVAL", "2"))
+CREDITS_FLUSH_BATCH = int(os.getenv("CREDITS_FLUSH_BATCH", "200"))
+
+# Shards published to Aleph at the same time by a flush
+CREDITS_PUBLISH_CONCURRENCY = 8
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS credit_events (
+    event_id TEXT PRIMARY KEY,
+    address TEXT NOT NULL,
+    amount REAL NOT NULL,
+    created REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS credit_balances (
+    address TEXT PRIMARY KEY,
+    credited REAL NOT NULL,
+    base REAL,
+    published REAL
+);
+"""
+
+
+@cache
+def get_aleph_account() -> "ETHAccount":
+    """Aleph account, created on first use to keep the SDK out of startup"""
+    from aleph.sdk.chains.ethereum import ETHAccount
+
+    return ETHAccount(ALEPH_PRIVATE_KEY)
+
+
+def create_aleph_client() -> "AuthenticatedAlephHttpClient":
+    from aleph.sdk import AuthenticatedAlephHttpClient
+
+    # Not given a timeout: the SDK then serializes JSON bodies with an encoder
+    # that does not return strings
+    return AuthenticatedAlephHttpClient(account=get_aleph_account())
+
+
+def shard_of(address: str) -> str:
+    """Aggregate key holding the balance of a checksum address"""
+    return f"{CREDIT_BALANCES_KEY}_{address[2:4].lower()}"
+
+
+class CreditLedger:
+    """
+    Credit balances of every address, published to Aleph in 256 aggregate shards.
+
+    Every credit is an event recorded in a local SQLite ledger under a unique id,
+    the transaction hash of the payment for webhooks, so that a payment is only
+    ever credited once. The ledger also keeps, per credited address, the total
+    credited locally and the balance Aleph had before (its base), which together
+    make the balance served.
+
+    A single writer publishes the balances changed since the last time, one
+    aggregate message per shard, every CREDITS_FLUSH_INTERVAL seconds. Balances are
+    published whole, so publishing one again after a crash changes nothing.
+
+    Addresses never credited locally are read from the shards, downloaded when
+    first needed and refreshed in the background when read after
+    CREDITS_REFRESH_INTERVAL seconds.
+
+    The new balance of a credited address is published as a `balance` event,
+    keyed by address.
+    """
+
+    def __init__(self, conn: sqlite3.Connection) -> None:
+        self.conn = conn
+        # A credit must not be lost once recorded, even by a power failure
+        self.conn.execute("PRAGMA synchronous=FULL")
+        self.conn.executescript(SCHEMA)
+        # File of the database, for the connections of worker threads
+        self._path: str = self.conn.execute("PRAGMA database_list").fetchone()[2]
+        self._client: "AuthenticatedAlephHttpClient | None" = None
+        self._client_lock = asyncio.Lock()
+        # Downloaded balances and when they were downloaded, by shard
+        self._shards: dict[str, dict[str, float]] = {}
+        self._refreshed_at: dict[str, float] = {}
+        self._downloads: dict[str, asyncio.Task[dict[str, float]]] = {}
+        # Addresses whose balance changed since it was last published
+        self._unpublished = {
+            address
+            for (address,) in self.conn.execute(
+                "SELECT address FROM credit_balances WHERE base IS NULL "
+                "OR published IS NULL OR published != base + credited"
+            )
+        }
+        self._flush_requested = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self.events = Broadcaster()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        try:
+            await self.flush()
+        except Exception as e:
+            print(f"Error publishing credit balances: {e}")
+        for task in list(self._downloads.values()):
+            task.cancel()
+        if self._client is not None:
+            await self._client.__aexit__(None, None, None)
+            self._client = None
+
+    async def balance(self, address: str) -> float:
+        """Balance of a checksum address, unpublished credits included"""
+        return (await self.balances([address]))[address]
+
+    async def balances(self, addresses: Sequence[str]) -> dict[str, float]:
+        """
+        Balances of many checksum addresses, unpublished credits included, read
+        from the ledger at once and from the shards they need
+        """
+        placeholders = ", ".join("?" * len(addresses))
+        local = {
+            address: (credited, base)
+            for address, credited, base in self.conn.execute(
+                "SELECT address, credited, base FROM credit_balances WHERE address "
+                f"IN ({placeholders})",
+                addresses,
+            )
+        }
+        keys = list(
+            dict.fromkeys(
+                shard_of(address)
+                for address in addresses
+                if local.get(address, (0.0, None))[1] is None
+            )
+        )
+        shards = dict(zip(keys, await asyncio.gather(*map(self._shard, keys))))
+
+        balances = {}
+        for address in addresses:
+            credited, base = local.get(address, (0.0, None))
+            if base is None:
+                base = shards[shard_of(address)].get(address, 0.0)
+            balances[address] = base + credited
+        return balances
+
+    def credit(self, event_id: str, address: str, amount: float) -> bool:
+        """
+        Credit a checksum address, unless the event `event_id` was already
+        credited. Returns whether it was credited, the credit is durable once this
+        returns.
+        """
+        return self.credit_many([(event_id, address, amount)])[0]
+
+    def credit_many(self, credits: Sequence[tuple[str, str, float]]) -> list[bool]:
+        """
+        Apply many `(event_id, address, amount)` credits in a single transaction,
+        all of them or none. Returns whether each one was credited, events already
+        credited are skipped. The changed balances are published together.
+        """
+        credited = _insert_credits(self.conn, credits)
+        self._credited(credits, credited)
+        return credited
+
+    async def credit_many_in_thread(
+        self, credits: Sequence[tuple[str, str, float]]
+    ) -> list[bool]:
+        """
+        Same as `credit_many`, for large batches: the transaction is written and
+        synced from a worker thread, through a connection of its own, instead of
+        holding the event loop
+        """
+
+        def insert() -> list[bool]:
+            conn = sqlite3.connect(self._path)
+            try:
+                conn.execute("PRAGMA synchronous=FULL")
+                return _insert_credits(conn, credits)
+            finally:
+                conn.close()
+
+        credited = await asyncio.to_thread(insert)
+        self._credited(credits, credited)
+        return credited
+
+    async def stream(self, address: str) -> AsyncIterator[str]:
+        """
+        Server-sent `balance` events of a checksum address: its current balance at
+        once, then its new balance every time it is credited
+        """
+
+        async def current() -> str:
+            balance = await self.balance(address)
+            return format_event("balance", {"address": address, "balance": balance})
+
+        # Subscribed before the balance is read, which may download its shard:
+        # credits applied meanwhile are sent right after it
+        async for message in self.events.stream(address, first=current):
+            yield message
+
+    async def flush(self) -> None:
+        """Publish the balances changed since they were last published"""
+        by_shard: dict[str, list[str]] = {}
+        for address in self._unpublished:
+            by_shard.setdefault(shard_of(address), []).append(address)
+
+        semaphore = asyncio.Semaphore(CREDITS_PUBLISH_CONCURRENCY)
+
+        async def publish(key: str, addresses: list[str]) -> None:
+            async with semaphore:
+                await self._publish_shard(key, addresses)
+
+        results = await asyncio.gather(
+            *(publish(key, addresses) for key, addresses in by_shard.items()),
+            return_exceptions=True,
+        )
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+
+    async def refresh(self, key: str) -> dict[str, float]:
+        """Download a shard"""
+        client = await self._open()
+        try:
+            async with asyncio.timeout(CREDITS_TIMEOUT):
+                with track("aleph", "fetch_aggregate"):
+                    balances = await client.fetch_aggregate(
+                        address=get_aleph_account().get_address(), key=key
+                    )
+        except aiohttp.ClientResponseError as e:
+            # Nothing was ever posted by this account
+            if e.status != 404:
+                raise
+            balances = None
+        # The SDK types aggregates as dicts of dicts, ours map addresses to floats
+        self._shards[key] = dict(cast(dict[str, float], balances or {}))
+        self._refreshed_at[key] = time.monotonic()
+        return self._shards[key]
+
+    async def _publish_shard(self, key: str, addresses: list[str]) -> None:
+        placeholders = ", ".join("?" * len(addresses))
+        if self.conn.execute(
+            "SELECT 1 FROM credit_balances WHERE base IS NULL AND address IN "
+            f"({placeholders})",
+            addresses,
+        ).fetchone():
+            # Credited for the first time, from the balance Aleph had until now
+            current = await self.refresh(key)
+            with self.conn:
+                self.conn.executemany(
+                    "UPDATE credit_balances SET base = ? "
+                    "WHERE address = ? AND base IS NULL",
+                    [(current.get(address, 0.0), address) for address in addresses],
+                )
+        balances = dict(
+            self.conn.execute(
+                "SELECT address, base + credited FROM credit_balances WHERE address "
+                f"IN ({placeholders})",
+                addresses,
+            )
+        )
+        # Aleph merges the keys of an aggregate with the ones posted before,
+        # only the changed balances need to be sent
+        await self._post(key, balances)
+
+        with self.conn:
+            self.conn.executemany(
+                "UPDATE credit_balances SET published = ? WHERE address = ?",
+                [(balance, address) for address, balance in balances.items()],
+            )
+        shard = self._shards.setdefault(key, {})
+        for address, balance in balances.items():
+            shard[address] = balance
+            # Unless credited again while publishing
+            if self._current(address) == balance:
+                self._unpublished.discard(address)
+
+    def _credited(
+        self, credits: Sequence[tuple[str, str, float]], credited: list[bool]
+    ) -> None:
+        """Queue the balances changed by recorded credits and announce them"""
+        addresses = [
+            address for (_, address, _), inserted in zip(credits, credited) if inserted
+        ]
+        self._unpublished.update(addresses)
+        if len(self._unpublished) >= CREDITS_FLUSH_BATCH:
+            self._flush_requested.set()
+        for address in dict.fromkeys(addresses):
+            if self.events.subscribed(address):
+                self.events.publish(
+                    "balance",
+                    {"address": address, "balance": self._known_balance(address)},
+                    key=address,
+                )
+
+    def _known_balance(self, address: str) -> float:
+        """Balance of a credited address, from its shard as last downloaded"""
+        credited, base = self.conn.execute(
+            "SELECT credited, base FROM credit_balances WHERE address = ?",
+            (address,),
+        ).fetchone()
+        if base is None:
+            base = self._shards.get(shard_of(address), {}).get(address, 0.0)
+        return base + credited
+
+    def _current(self, address: str) -> float | None:
+        row = self.conn.execute(
+            "SELECT base + credited FROM credit_balances WHERE address = ?",
+            (address,),
+        ).fetchone()
+        return row[0] if row else None
+
+    async def _post(self, key: str, balances: dict[str, float]) -> None:
+        client = await self._open()
+        async with asyncio.timeout(CREDITS_TIMEOUT):
+            with track("aleph", "create_aggregate"):
+                await client.create_aggregate(key=key, content=balances)
+
+    async def _shard(self, key: str) -> dict[str, float]:
+        """Balances of a shard, downloaded the first time and refreshed when old"""
+        balances = self._shards.get(key)
+        if balances is None:
+            return await asyncio.shield(self._download(key))
+        if time.monotonic() - self._refreshed_at[key] > CREDITS_REFRESH_INTERVAL:
+            # Served as they are meanwhile
+            self._download(key)
+        return balances
+
+    def _download(self, key: str) -> asyncio.Task[dict[str, float]]:
+        """Refresh a shard, sharing the download with concurrent callers"""
+        task = self._downloads.get(key)
+        if task is None:
+            task = asyncio.create_task(self.refresh(key))
+            self._downloads[key] = task
+            task.add_done_callback(lambda _: self._downloads.pop(key, None))
+            task.add_done_callback(_log_failed_download)
+        return task
+
+    async def _open(self) -> "AuthenticatedAlephHttpClient":
+        async with self._client_lock:
+            if self._client is None:
+                # Importing the SDK takes a while, keep it off the event loop
+                client = await asyncio.to_thread(create_aleph_client)
+                await client.__aenter__()
+                self._client = client
+        return self._client
+
+    async def _flush_loop(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(
+                    self._flush_requested.wait(), CREDITS_FLUSH_INTERVAL
+                )
+            except TimeoutError:
+                pass
+            self._flush_requested.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Error publishing credit balances: {e}")
+
+
+def _insert_credits(
+    conn: sqlite3.Connection, credits: Sequence[tuple[str, str, float]]
+) -> list[bool]:
+    """Record credits in a single transaction, returning which ones were new"""
+    credited = []
+    now = time.time()
+    with conn:
+        for event_id, address, amount in credits:
+            inserted = conn.execute(
+                "INSERT OR IGNORE INTO credit_events VALUES (?, ?, ?, ?)",
+                (event_id, address, amount, now),
+            ).rowcount
+            if inserted:
+                conn.execute(
+                    "INSERT INTO credit_balances (address, credited) VALUES (?, ?) "
+                    "ON CONFLICT (address) DO UPDATE SET credited = credited + ?",
+                    (address, amount, amount),
+                )
+            credited.append(bool(inserted))
+    return credited
+
+
+def _log_failed_download(task: asyncio.Task) -> None:
+    if not task.cancelled() and task.exception() is not None:
+        print(f"Error downloading credit balances: {task.exception()}")
@@ -0,0 +1,69 @@
+import asyncio
+import json
+from collections.abc import AsyncIterator, Awaitable, Callable, Hashable
+from typing import Any
+
+# Events buffered per subscriber before new ones get dropped for it
+SUBSCRIBER_QUEUE_SIZE = 100
+
+# Delay after which an idle stream sends a comment to keep the connection open
+KEEPALIVE_INTERVAL = 15.0
+
+
+def format_event(event: str, data: dict[str, Any]) -> str:
+    """Serialize an event in the server-sent events wire format"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class Broadcaster:
+    """
+    In-process publisher fanning events out to server-sent events streams.
+
+    Subscribers listen either to a single key (a transaction hash, an address...)
+    or to every event, and publishing only touches the queues of the matching
+    subscribers. A subscriber too slow to drain its queue misses events rather
+    than making the publisher wait.
+    """
+
+    def __init__(self) -> None:
+        self._subscribers: dict[Hashable | None, set[asyncio.Queue]] = {}
+
+    def subscribed(self, key: Hashable) -> bool:
+        """Whether anyone listens to `key`, to skip building unwanted events"""
+        return key in self._subscribers or None in self._subscribers
+
+    def publish(self, event: str, data: dict[str, Any], key: Hashable = None) -> None:
+        message = format_event(event, data)
+        keys = (None,) if key is None else (key, None)
+        for subscribers_key in keys:
+            for queue in self._subscribers.get(subscribers_key, ()):
+                try:
+                    queue.put_nowait(message)
+                except asyncio.QueueFull:
+                    pass
+
+    async def stream(
+        self,
+        key: Hashable = None,
+        first: Callable[[], Awaitable[str]] | None = None,
+    ) -> AsyncIterator[str]:
+        """
+        Server-sent events for `key`, or for every event when `key` is None. The
+        message made by `first` comes before them, once subscribed so that no event
+        published while it is being made is missed.
+        """
+        queue: asyncio.Queue[str] = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self._subscribers.setdefault(key, set()).add(queue)
+        try:
+            if first is not None:
+                yield await first()
+            while True:
+                try:
+                    yield await asyncio.wait_for(queue.get(), KEEPALIVE_INTERVAL)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+        finally:
+            subscribers = self._subscribers[key]
+            subscribers.discard(queue)
+            if not subscribers:
+                del self._subscribers[key]
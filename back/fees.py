@@ -0,0 +1,103 @@
+import asyncio
+import time
+from collections import deque
+from typing import Any
+
+from web3 import AsyncWeb3
+
+# Delay between two fee refreshes, about one Base block (seconds)
+FEE_REFRESH_INTERVAL = 2.0
+
+# Fees older than this are refreshed on the request path instead (seconds)
+FEE_MAX_AGE = 30.0
+
+# Gas limit used for a method until its gas usage has been observed
+DEFAULT_GAS_LIMIT = 300_000
+
+# Headroom added on top of the highest gas usage observed for a method
+GAS_LIMIT_MARGIN = 1.25
+
+# Number of receipts per method the gas estimate is based on
+GAS_USAGE_WINDOW = 50
+
+
+class FeeOracle:
+    """
+    Serves EIP-1559 fee parameters and gas limits to the transaction builders.
+
+    The base fee of the latest block and the suggested priority fee are refreshed
+    in the background, so signing a transaction never waits on a fee RPC call.
+    Gas limits are learned per contract method from the receipts of the previous
+    transactions, instead of using the same worst case limit for every call.
+    """
+
+    def __init__(self, w3: AsyncWeb3) -> None:
+        self.w3 = w3
+        self._fees: dict[str, int] | None = None
+        self._refreshed_at = 0.0
+        self._gas_used: dict[str, deque[int]] = {}
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def fees(self) -> dict[str, int]:
+        """Fee fields for a new transaction"""
+        fees = self._fees
+        if fees is None or time.monotonic() - self._refreshed_at > FEE_MAX_AGE:
+            fees = await self.refresh()
+        return fees
+
+    def gas_limit(self, method: str) -> int:
+        gas_used = self._gas_used.get(method)
+        if not gas_used:
+            return DEFAULT_GAS_LIMIT
+        return int(max(gas_used) * GAS_LIMIT_MARGIN)
+
+    def observe(self, method: str, status: str, gas_used: int | None) -> None:
+        """Learn from the receipt of a transaction calling `method`"""
+        if status == "confirmed" and gas_used is not None:
+            self._gas_used.setdefault(method, deque(maxlen=GAS_USAGE_WINDOW)).append(
+                gas_used
+            )
+        elif status == "failed":
+            # Possibly out of gas, go back to the default limit until we know more
+            self._gas_used.pop(method, None)
+
+    async def refresh(self) -> dict[str, int]:
+        responses: Any = await self.w3.provider.make_batch_request(
+            [
+                ("eth_getBlockByNumber", ["latest", False]),
+                ("eth_maxPriorityFeePerGas", []),
+            ]
+        )
+        if not isinstance(responses, list) or any("error" in r for r in responses):
+            raise ValueError(f"Could not fetch fees: {responses}")
+
+        block, priority_fee = (response["result"] for response in responses)
+        base_fee = int(block["baseFeePerGas"], 16)
+        self._fees = {
+            # Stays valid even if the base fee doubles before inclusion
+            "maxFeePerGas": 2 * base_fee + int(priority_fee, 16),
+            "maxPriorityFeePerGas": int(priority_fee, 16),
+        }
+        self._refreshed_at = time.monotonic()
+        return self._fees
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                print(f"Error refreshing fees: {e}")
+            await asyncio.sleep(FEE_REFRESH_INTERVAL)
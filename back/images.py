@@ -0,0 +1,75 @@
+import io
+import warnings
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from PIL import Image
+
+# Side of the square avatar thumbnails (pixels)
+AVATAR_SIZES = (32, 64, 128, 256)
+
+# Encoding of the thumbnails
+AVATAR_FORMAT = "WEBP"
+AVATAR_EXTENSION = "webp"
+AVATAR_CONTENT_TYPE = "image/webp"
+AVATAR_QUALITY = 80
+
+# Name of the uploaded image in a pinned avatar directory
+ORIGINAL_NAME = "original"
+
+# Larger images are refused rather than decoded
+MAX_IMAGE_PIXELS = 40_000_000
+
+
+def variant_name(size: int) -> str:
+    return f"{size}.{AVATAR_EXTENSION}"
+
+
+def make_variants(path: str) -> dict[str, bytes]:
+    """
+    Decode the image file at `path` once and encode a square thumbnail of it for
+    every size in AVATAR_SIZES, by file name. Runs in a worker process.
+
+    Raises ValueError when the data is not an image that can be decoded.
+    """
+    # Only the worker processes need Pillow
+    from PIL import Image, ImageOps
+
+    Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("error", Image.DecompressionBombWarning)
+            with Image.open(path) as original:
+                # Let JPEG decode at a fraction of its size when that is enough
+                original.draft("RGB", (max(AVATAR_SIZES), max(AVATAR_SIZES)))
+                image: "Image.Image" = ImageOps.exif_transpose(original)
+                image = image.convert("RGBA" if _has_alpha(image) else "RGB")
+    except (Image.DecompressionBombError, Image.DecompressionBombWarning) as e:
+        raise ValueError("Image has too many pixels") from e
+    except (OSError, SyntaxError) as e:
+        raise ValueError("Not a supported image") from e
+
+    variants = {}
+    # Largest first, each thumbnail is downscaled from the previous one
+    for size in sorted(AVATAR_SIZES, reverse=True):
+        image = ImageOps.fit(image, (size, size), Image.Resampling.LANCZOS)
+        output = io.BytesIO()
+        image.save(output, AVATAR_FORMAT, quality=AVATAR_QUALITY)
+        variants[variant_name(size)] = output.getvalue()
+    return variants
+
+
+def variant_url(avatar_url: str, size: int) -> str:
+    """
+    URL of the smallest thumbnail at least `size` pixels wide of an avatar
+    directory URL. Other avatar URLs are returned unchanged.
+    """
+    directory, _, name = avatar_url.rpartition("/")
+    if name != ORIGINAL_NAME:
+        return avatar_url
+    fitting = [s for s in AVATAR_SIZES if s >= size]
+    return f"{directory}/{variant_name(min(fitting) if fitting else max(AVATAR_SIZES))}"
+
+
+def _has_alpha(image: "Image.Image") -> bool:
+    return image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info
@@ -0,0 +1,254 @@
+import asyncio
+import os
+import sqlite3
+from collections.abc import Callable, Iterator
+from typing import Any
+
+from eth_utils import keccak
+from web3 import AsyncWeb3
+from web3.contract.async_contract import AsyncContract, AsyncContractEvent
+
+# Number of blocks requested per eth_getLogs call
+INDEXER_BLOCK_RANGE = int(os.getenv("INDEXER_BLOCK_RANGE", "2000"))
+
+# Block to start indexing from when there is no checkpoint yet. The registry was
+# deployed on Base after this block (late November 2024, before its Durin
+# contracts were released), so no log of it is older.
+INDEXER_START_BLOCK = int(os.getenv("INDEXER_START_BLOCK") or "23000000")
+
+# Delay between two polls of the chain head once the index is up to date (seconds)
+INDEXER_POLL_INTERVAL = 2.0
+
+# Blocks are only indexed once they are this deep, to stay clear of reorgs
+INDEXER_CONFIRMATIONS = 5
+
+# The index is considered up to date while it is at most this many blocks behind
+INDEXER_SYNC_TOLERANCE = 50
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS checkpoint (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    block INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS names (
+    node BLOB PRIMARY KEY,
+    labelhash BLOB NOT NULL,
+    label TEXT NOT NULL,
+    owner TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS names_labelhash ON names (labelhash);
+CREATE TABLE IF NOT EXISTS usernames (
+    address TEXT PRIMARY KEY,
+    label TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS addresses (
+    node BLOB PRIMARY KEY,
+    address TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS texts (
+    node BLOB NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (node, key)
+);
+"""
+
+
+class EnsIndex:
+    """
+    Local copy of the registrar and registry records, built from their logs.
+
+    - `names`: subnames created in the registry, from `SubnodeCreated`
+    - `usernames`: address to label, from the registrar `NameRegistered`
+    - `addresses`: node to address, from `AddrChanged`
+    - `texts`: node text records, from `TextChanged`
+    """
+
+    def __init__(self, conn: sqlite3.Connection) -> None:
+        self.conn = conn
+        self.conn.executescript(SCHEMA)
+        row = self.conn.execute("SELECT block FROM checkpoint").fetchone()
+        # Last block fully applied to the index
+        self.checkpoint: int | None = row[0] if row else None
+
+    def get_username(self, address: str) -> str | None:
+        row = self.conn.execute(
+            "SELECT label FROM usernames WHERE address = ?", (address,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def get_address(self, node: bytes) -> str | None:
+        row = self.conn.execute(
+            "SELECT address FROM addresses WHERE node = ?", (node,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def get_text(self, node: bytes, key: str) -> str | None:
+        row = self.conn.execute(
+            "SELECT value FROM texts WHERE node = ? AND key = ?", (node, key)
+        ).fetchone()
+        return row[0] if row else None
+
+    def is_registered(self, node: bytes) -> bool:
+        row = self.conn.execute("SELECT 1 FROM names WHERE node = ?", (node,))
+        return row.fetchone() is not None
+
+    def labels(self) -> Iterator[str]:
+        """Every registered label, in no particular order"""
+        for (label,) in self.conn.execute("SELECT label FROM names"):
+            yield label
+
+    def forget_text(self, node: bytes, key: str) -> None:
+        """Drop a text record we know is about to change on chain"""
+        with self.conn:
+            self.conn.execute(
+                "DELETE FROM texts WHERE node = ? AND key = ?", (node, key)
+            )
+
+    def apply(self, events: list[Any], block: int) -> list[str]:
+        """
+        Apply decoded events in chain order and move the checkpoint to `block`.
+        Returns the labels of the subnames created by these events.
+        """
+        created = []
+        with self.conn:
+            for event in events:
+                args = event["args"]
+                if event["event"] == "SubnodeCreated":
+                    label = _first_dns_label(args["name"])
+                    self.conn.execute(
+                        "INSERT OR REPLACE INTO names VALUES (?, ?, ?, ?)",
+                        (args["node"], keccak(text=label), label, args["owner"]),
+                    )
+                    created.append(label)
+                elif event["event"] == "NameRegistered":
+                    # The label is an indexed string, so only its hash is in the
+                    # log. The subnode was created earlier in the same transaction.
+                    row = self.conn.execute(
+                        "SELECT label FROM names WHERE labelhash = ?",
+                        (args["label"],),
+                    ).fetchone()
+                    if row is not None:
+                        self.conn.execute(
+                            "INSERT OR REPLACE INTO usernames VALUES (?, ?)",
+                            (args["owner"], row[0]),
+                        )
+                elif event["event"] == "AddrChanged":
+                    self.conn.execute(
+                        "INSERT OR REPLACE INTO addresses VALUES (?, ?)",
+                        (args["node"], args["a"]),
+                    )
+                elif event["event"] == "TextChanged":
+                    self.conn.execute(
+                        "INSERT OR REPLACE INTO texts VALUES (?, ?, ?)",
+                        (args["node"], args["key"], args["value"]),
+                    )
+            self.conn.execute(
+                "INSERT OR REPLACE INTO checkpoint (id, block) VALUES (0, ?)",
+                (block,),
+            )
+        self.checkpoint = block
+        return created
+
+
+def _first_dns_label(name: bytes) -> str:
+    """Extract `alice` from the DNS wire format of `alice.bedrock-app.eth`"""
+    return name[1 : 1 + name[0]].decode("utf-8")
+
+
+class EnsIndexer:
+    """
+    Follows the registrar and registry logs from the index checkpoint.
+
+    Logs of both contracts are fetched together, INDEXER_BLOCK_RANGE blocks at a
+    time, and each range is applied to the index in a single SQLite transaction
+    along with its checkpoint, so a restart resumes exactly where it stopped.
+    """
+
+    def __init__(
+        self,
+        w3: AsyncWeb3,
+        index: EnsIndex,
+        registrar_contract: AsyncContract,
+        registry_contract: AsyncContract,
+        on_names_created: Callable[[list[str]], None] | None = None,
+    ) -> None:
+        self.w3 = w3
+        self.index = index
+        self.registrar_contract = registrar_contract
+        self.registry_contract = registry_contract
+        self.on_names_created = on_names_created
+        self.head: int | None = None
+        # Events indexed, by topic
+        self._events: dict[str, AsyncContractEvent] = {
+            event.topic: event()
+            for event in (
+                registrar_contract.events.NameRegistered,
+                registry_contract.events.SubnodeCreated,
+                registry_contract.events.AddrChanged,
+                registry_contract.events.TextChanged,
+            )
+        }
+        self._task: asyncio.Task | None = None
+
+    @property
+    def synced(self) -> bool:
+        """Whether the index is recent enough to answer lookups"""
+        checkpoint = self.index.checkpoint
+        return (
+            self.head is not None
+            and checkpoint is not None
+            and self.head - checkpoint <= INDEXER_CONFIRMATIONS + INDEXER_SYNC_TOLERANCE
+        )
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self._sync()
+            except Exception as e:
+                print(f"Error indexing ENS logs: {e}")
+            await asyncio.sleep(INDEXER_POLL_INTERVAL)
+
+    async def _sync(self) -> None:
+        checkpoint = self.index.checkpoint
+        if checkpoint is None:
+            checkpoint = INDEXER_START_BLOCK - 1
+
+        self.head = await self.w3.eth.block_number
+        target = self.head - INDEXER_CONFIRMATIONS
+        while checkpoint < target:
+            to_block = min(checkpoint + INDEXER_BLOCK_RANGE, target)
+            logs = await self.w3.eth.get_logs(
+                {
+                    "fromBlock": checkpoint + 1,
+                    "toBlock": to_block,
+                    "address": [
+                        self.registrar_contract.address,
+                        self.registry_contract.address,
+                    ],
+                    "topics": [list(self._events)],
+                }
+            )
+            created = self.index.apply(
+                [
+                    self._events[log["topics"][0].to_0x_hex()].process_log(log)
+                    for log in logs
+                ],
+                to_block,
+            )
+            if created and self.on_names_created is not None:
+                self.on_names_created(created)
+            checkpoint = to_block
@@ -0,0 +1,132 @@
+import hashlib
+import sqlite3
+from typing import BinaryIO
+
+# Parameters of the default `ipfs add` import, which Pinata uses for CIDv0
+CHUNK_SIZE = 256 * 1024
+MAX_LINKS = 174
+
+# UnixFS node type of a file
+UNIXFS_FILE = 2
+
+BASE58_ALPHABET = "123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pins (
+    local_cid TEXT PRIMARY KEY,
+    cid TEXT NOT NULL
+);
+"""
+
+
+def file_cid(file: BinaryIO) -> str:
+    """
+    CIDv0 IPFS gives to the content of `file` from its current position, read in
+    chunks. The file is imported the way `ipfs add` does by default: 256 KiB
+    chunks stored in UnixFS leaves, linked by a balanced DAG of 174 links per node.
+    """
+    # (multihash, cumulative block size, file size) of the nodes of a level
+    nodes: list[tuple[bytes, int, int]] = []
+    while chunk := file.read(CHUNK_SIZE):
+        block = _pb_node(_unixfs(len(chunk), data=chunk), [])
+        nodes.append((_multihash(block), len(block), len(chunk)))
+
+    if not nodes:
+        block = _pb_node(_unixfs(0), [])
+        return _base58(_multihash(block))
+
+    while len(nodes) > 1:
+        parents = []
+        for i in range(0, len(nodes), MAX_LINKS):
+            children = nodes[i : i + MAX_LINKS]
+            block = _pb_node(
+                _unixfs(
+                    sum(size for _, _, size in children),
+                    blocksizes=[size for _, _, size in children],
+                ),
+                [(multihash, tsize) for multihash, tsize, _ in children],
+            )
+            parents.append(
+                (
+                    _multihash(block),
+                    len(block) + sum(tsize for _, tsize, _ in children),
+                    sum(size for _, _, size in children),
+                )
+            )
+        nodes = parents
+    return _base58(nodes[0][0])
+
+
+def _varint(value: int) -> bytes:
+    out = bytearray()
+    while value > 0x7F:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _field(number: int, value: bytes) -> bytes:
+    """Length-delimited protobuf field"""
+    return _varint(number << 3 | 2) + _varint(len(value)) + value
+
+
+def _uint_field(number: int, value: int) -> bytes:
+    return _varint(number << 3) + _varint(value)
+
+
+def _unixfs(
+    filesize: int, data: bytes = b"", blocksizes: list[int] | None = None
+) -> bytes:
+    out = _uint_field(1, UNIXFS_FILE)
+    if data:
+        out += _field(2, data)
+    out += _uint_field(3, filesize)
+    for blocksize in blocksizes or []:
+        out += _uint_field(4, blocksize)
+    return out
+
+
+def _pb_node(data: bytes, links: list[tuple[bytes, int]]) -> bytes:
+    # dag-pb puts the links before the data, each with an empty name
+    out = b""
+    for multihash, tsize in links:
+        out += _field(2, _field(1, multihash) + _field(2, b"") + _uint_field(3, tsize))
+    return out + _field(1, data)
+
+
+def _multihash(block: bytes) -> bytes:
+    # sha2-256 code and digest length
+    return b"\x12\x20" + hashlib.sha256(block).digest()
+
+
+def _base58(value: bytes) -> str:
+    number = int.from_bytes(value, "big")
+    out = ""
+    while number:
+        number, remainder = divmod(number, 58)
+        out = BASE58_ALPHABET[remainder] + out
+    return BASE58_ALPHABET[0] * (len(value) - len(value.lstrip(b"\0"))) + out
+
+
+class PinIndex:
+    """
+    Uploads already pinned, by the CID computed locally for their content, along
+    with the CID Pinata returned for what was pinned from them.
+    """
+
+    def __init__(self, conn: sqlite3.Connection) -> None:
+        self.conn = conn
+        self.conn.executescript(SCHEMA)
+
+    def get(self, local_cid: str) -> str | None:
+        row = self.conn.execute(
+            "SELECT cid FROM pins WHERE local_cid = ?", (local_cid,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def add(self, local_cid: str, cid: str) -> None:
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO pins VALUES (?, ?)", (local_cid, cid)
+            )
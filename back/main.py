@@ -1,43 +1,320 @@
+import asyncio
 import json
 import os
-from typing import Any
+import shutil
+import tempfile
+from contextlib import asynccontextmanager
+from dataclasses import asdict
+from functools import partial
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    AsyncIterator,
+    Awaitable,
+    BinaryIO,
+    Callable,
+    Hashable,
+    IO,
+    Literal,
+    Sequence,
+)
 
-import aiohttp
 from dotenv import load_dotenv
+from eth_account.signers.local import LocalAccount
 from eth_utils import keccak
 from fastapi import FastAPI, HTTPException, Query, UploadFile, File, Request, Header
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from web3 import Web3
+from fastapi.responses import (
+    FileResponse,
+    JSONResponse,
+    PlainTextResponse,
+    RedirectResponse,
+    Response,
+    StreamingResponse,
+)
+from hexbytes import HexBytes
+from pydantic import BaseModel, Field
+from web3 import AsyncWeb3, Web3
+from web3.contract.async_contract import AsyncContract
+
+from avatars import (
+    AVATAR_FALLBACK_URL,
+    AVATAR_STORE_MAX_BYTES,
+    AvatarFetcher,
+    AvatarStore,
+    is_proxied,
+)
+from cache import K, TTLCache
+from credits import CreditLedger
+from fees import FeeOracle
+from images import AVATAR_CONTENT_TYPE, ORIGINAL_NAME, make_variants, variant_url
+from indexer import EnsIndex, EnsIndexer
+from ipfs import PinIndex, file_cid
+from metrics import CONTENT_TYPE, MetricsMiddleware, name_contract_functions, render
+from multicall import Multicall
+from pinata import PinataClient, gateway_url
+from receipts import ReceiptTracker, TrackedTransaction
+from rpc import RpcPool, attach_rpc_session, create_rpc_session
+from search import PrefixIndex
+from storage import DATA_DIR, connect
+from thirdweb_webhook import (
+    thirdweb_webhook,
+    get_credits,
+    get_credits_many,
+    add_credits_direct,
+    add_credits_bulk,
+    process_webhook,
+)
+from transactions import TransactionSubmitter
+from webhook_queue import WebhookQueue
 
-from thirdweb_webhook import thirdweb_webhook, get_credits, add_credits_direct, ThirdwebWebhookPayload
+if TYPE_CHECKING:
+    from concurrent.futures import ProcessPoolExecutor
 
 load_dotenv()
 REGISTRAR_CONTRACT_ADDRESS = "0x30afcf8bddd96b3e2b0210f8f003aafd4a52f628"
 REGISTRY_CONTRACT_ADDRESS = "0x2565b1f8bfd174d3acb67fd1a377b8014350dc26"
 
 code_dir = os.path.dirname(os.path.abspath(__file__))
-with open(os.path.join(code_dir, "abis/registrar.json"), "r") as abi_file:
-    REGISTRAR_CONTRACT_ABI = json.load(abi_file)
-with open(os.path.join(code_dir, "abis/registry.json"), "r") as abi_file:
-    REGISTRY_CONTRACT_ABI = json.load(abi_file)
 
 PRIVATE_KEY = os.getenv("BEDROCK_PRIVATE_KEY")
 PINATA_JWT = os.getenv("PINATA_JWT")
+# Comma separated list of RPC endpoints
 BASE_RPC_URL = os.getenv("BASE_RPC_URL", "https://mainnet.base.org")
 
-w3 = Web3(Web3.HTTPProvider(BASE_RPC_URL))
-account = w3.eth.account.from_key(PRIVATE_KEY)
-registrar_contract = w3.eth.contract(
-    address=Web3.to_checksum_address(REGISTRAR_CONTRACT_ADDRESS),
-    abi=REGISTRAR_CONTRACT_ABI,
-)
-registry_contract = w3.eth.contract(
-    address=Web3.to_checksum_address(REGISTRY_CONTRACT_ADDRESS),
-    abi=REGISTRY_CONTRACT_ABI,
+# Maximum number of entries accepted by the batch lookup routes
+MAX_BATCH_LOOKUPS = 1000
+
+# Maximum number of usernames returned by a search
+MAX_SEARCH_RESULTS = 100
+
+# Maximum number of names registered by a single bulk registration
+MAX_BULK_REGISTRATIONS = 1000
+
+# Maximum number of credit grants applied by a single bulk grant
+MAX_BULK_CREDIT_GRANTS = 10_000
+
+# Shortest label the registrar accepts
+MIN_USERNAME_LENGTH = 3
+
+# How long ENS records are served from memory, per record type (seconds)
+AVAILABLE_CACHE_TTL = 30
+USERNAME_CACHE_TTL = 600
+ADDRESS_CACHE_TTL = 600
+AVATAR_CACHE_TTL = 600
+ENS_CACHE_MAX_SIZE = 50_000
+
+# Largest avatar image accepted (bytes)
+MAX_AVATAR_SIZE = 20 * 1024 * 1024
+
+# Room left in the request body for the multipart headers around the avatar
+MULTIPART_OVERHEAD = 16 * 1024
+
+# Browser and edge caching of the served avatar images: fresh as long as the
+# avatar URL cache, then revalidated in the background with the ETag for a week
+AVATAR_IMAGE_CACHE_CONTROL = (
+    f"public, max-age={AVATAR_CACHE_TTL}, stale-while-revalidate={7 * 24 * 3600}"
 )
 
-app = FastAPI()
+# Number of processes resizing avatars
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))
+
+available_cache = TTLCache(ttl=AVAILABLE_CACHE_TTL, max_size=ENS_CACHE_MAX_SIZE)
+username_cache = TTLCache(ttl=USERNAME_CACHE_TTL, max_size=ENS_CACHE_MAX_SIZE)
+address_cache = TTLCache(ttl=ADDRESS_CACHE_TTL, max_size=ENS_CACHE_MAX_SIZE)
+avatar_cache = TTLCache(ttl=AVATAR_CACHE_TTL, max_size=ENS_CACHE_MAX_SIZE)
+pinata = PinataClient(PINATA_JWT)
+username_search = PrefixIndex()
+
+# Everything below needs the configuration, the ABIs or the data directory. It is
+# created by `init` when the application starts, so importing this module stays
+# cheap and free of side effects.
+rpc_pool: RpcPool
+w3: AsyncWeb3
+account: LocalAccount
+registrar_contract: AsyncContract
+registry_contract: AsyncContract
+multicall: Multicall
+fee_oracle: FeeOracle
+receipt_tracker: ReceiptTracker
+submitter: TransactionSubmitter
+ens_index: EnsIndex
+pin_index: PinIndex
+avatar_fetcher: AvatarFetcher
+credit_ledger: CreditLedger
+webhook_queue: WebhookQueue
+indexer: EnsIndexer
+# Set once `username_search` holds every indexed username
+username_search_ready: asyncio.Event
+
+# Created on the first avatar upload
+image_pool: "ProcessPoolExecutor | None" = None
+
+# Cache invalidations to run again once their transaction is mined, by hash: reads
+# made between the submission and the block still see the old record on chain
+pending_invalidations: dict[str, Callable[[], None]] = {}
+
+
+def load_abi(name: str) -> Any:
+    with open(os.path.join(code_dir, "abis", name), "r") as abi_file:
+        return json.load(abi_file)
+
+
+def init() -> None:
+    """Create the blockchain clients and open the local stores"""
+    global rpc_pool, w3, account, registrar_contract, registry_contract, multicall
+    global fee_oracle, receipt_tracker, submitter, ens_index, pin_index
+    global avatar_fetcher, credit_ledger, webhook_queue, indexer
+    global username_search_ready
+
+    rpc_pool = RpcPool([url.strip() for url in BASE_RPC_URL.split(",") if url.strip()])
+    w3 = AsyncWeb3(rpc_pool)
+    account = w3.eth.account.from_key(PRIVATE_KEY)
+    registrar_contract = w3.eth.contract(
+        address=Web3.to_checksum_address(REGISTRAR_CONTRACT_ADDRESS),
+        abi=load_abi("registrar.json"),
+    )
+    registry_contract = w3.eth.contract(
+        address=Web3.to_checksum_address(REGISTRY_CONTRACT_ADDRESS),
+        abi=load_abi("registry.json"),
+    )
+    multicall = Multicall(w3)
+    for contract in (registrar_contract, registry_contract, multicall.contract):
+        name_contract_functions(contract.abi)
+
+    fee_oracle = FeeOracle(w3)
+    receipt_tracker = ReceiptTracker(
+        w3,
+        account.address,
+        on_finished=transaction_finished,
+    )
+    submitter = TransactionSubmitter(
+        w3, account, fee_oracle, on_sent=receipt_tracker.track
+    )
+    ens_index = EnsIndex(connect("ens_index.sqlite3"))
+    pin_index = PinIndex(connect("pins.sqlite3"))
+    avatar_fetcher = AvatarFetcher(
+        AvatarStore(
+            os.path.join(DATA_DIR, "avatars"),
+            connect("avatars.sqlite3"),
+            AVATAR_STORE_MAX_BYTES,
+        )
+    )
+    credit_ledger = CreditLedger(connect("credits.sqlite3"))
+    webhook_queue = WebhookQueue(
+        connect("webhooks.sqlite3"),
+        handler=lambda body: process_webhook(credit_ledger, body),
+    )
+    indexer = EnsIndexer(
+        w3,
+        ens_index,
+        registrar_contract,
+        registry_contract,
+        on_names_created=username_search.add_many,
+    )
+    username_search_ready = asyncio.Event()
+
+
+def copy_upload(upload: BinaryIO, output: IO[bytes]) -> None:
+    """Copy an upload from its start chunk by chunk, for another process to read"""
+    upload.seek(0)
+    shutil.copyfileobj(upload, output)
+    output.flush()
+
+
+def get_image_pool() -> "ProcessPoolExecutor":
+    global image_pool
+    if image_pool is None:
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+
+        # Spawned workers start without a copy of this process
+        image_pool = ProcessPoolExecutor(
+            max_workers=IMAGE_WORKERS, mp_context=multiprocessing.get_context("spawn")
+        )
+    return image_pool
+
+
+async def load_username_search() -> None:
+    """Fill the username search from the ENS index, then start following the chain"""
+
+    def load() -> None:
+        # Read through a connection of its own, the main one belongs to the loop
+        conn = connect("ens_index.sqlite3")
+        try:
+            username_search.add_many(EnsIndex(conn).labels())
+        finally:
+            conn.close()
+
+    try:
+        await asyncio.to_thread(load)
+    except Exception as e:
+        # Searches then only find the names indexed from now on
+        print(f"Error loading the username search: {e}")
+    username_search_ready.set()
+    # Started last so that no name is added to the search while it is loading
+    indexer.start()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    init()
+    rpc_session = create_rpc_session()
+    await attach_rpc_session(w3, rpc_session)
+    rpc_pool.start()
+    fee_oracle.start()
+    pinata.start()
+    credit_ledger.start()
+    webhook_queue.start()
+    avatar_fetcher.start()
+    submitter.start()
+    receipt_tracker.start()
+    # Loading a large index takes a while, it must not hold the first requests
+    loading = asyncio.create_task(load_username_search())
+    try:
+        yield
+    finally:
+        loading.cancel()
+        await indexer.stop()
+        await receipt_tracker.stop()
+        await submitter.stop()
+        await avatar_fetcher.stop()
+        await webhook_queue.stop()
+        await credit_ledger.stop()
+        await pinata.stop()
+        if image_pool is not None:
+            image_pool.shutdown(wait=False, cancel_futures=True)
+        await fee_oracle.stop()
+        await rpc_pool.stop()
+        await rpc_session.close()
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+# Middlewares added last wrap the ones added before them. This one comes first so
+# that its early answers still go through CORS and get measured.
+@app.middleware("http")
+async def limit_avatar_upload_size(
+    request: Request, call_next: Callable[[Request], Awaitable[Any]]
+) -> Any:
+    # Reject oversized avatars from their headers, before the body is received
+    if request.method == "POST" and request.url.path.endswith("/avatar"):
+        content_length = request.headers.get("content-length", "")
+        # Without it, the multipart parser would spool the whole body to disk
+        # before the size of the avatar is known
+        if not content_length.isdigit():
+            return JSONResponse(
+                status_code=411,
+                content={"detail": "Avatar uploads must have a Content-Length"},
+            )
+        if int(content_length) > MAX_AVATAR_SIZE + MULTIPART_OVERHEAD:
+            return JSONResponse(
+                status_code=413,
+                content={"detail": f"Avatar is larger than {MAX_AVATAR_SIZE} bytes"},
+            )
+    return await call_next(request)
+
 
 app.add_middleware(
     CORSMiddleware,
@@ -45,6 +322,8 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Outermost, so that the time spent in the other middlewares is measured too
+app.add_middleware(MetricsMiddleware)
 
 
 def namehash(name: str) -> bytes:
@@ -61,11 +340,98 @@ def namehash(name: str) -> bytes:
     return node  # returns 32-byte hash
 
 
+async def lookup(
+    key: Hashable,
+    index_lookup: Callable[[Any], Any],
+    cache: TTLCache,
+    load: Callable[[], Awaitable[Any]],
+) -> Any:
+    """Resolve a record from the local index, falling back to the cached RPC call"""
+    if indexer.synced:
+        value = index_lookup(key)
+        if value is not None:
+            return value
+    return await cache.get_or_load(key, load)
+
+
+async def lookup_many(
+    keys: Sequence[K],
+    index_lookup: Callable[[K], Any],
+    cache: TTLCache,
+    load_many: Callable[[list[K]], Awaitable[Sequence[Any]]],
+) -> dict[K, Any]:
+    """Same as `lookup` for many keys, RPC fallbacks are made in a single call"""
+    values: dict[K, Any] = {}
+    if indexer.synced:
+        for key in keys:
+            value = index_lookup(key)
+            if value is not None:
+                values[key] = value
+
+    missing = [key for key in keys if key not in values]
+    if missing:
+        values.update(await cache.get_or_load_many(missing, load_many))
+    return values
+
+
+async def avatar_url_of(username: str, size: int | None = None) -> str:
+    """Avatar URL of a username, or of its thumbnail closest to `size`"""
+    node = namehash(f"{username}.bedrock-app.eth")
+    avatar_url = await lookup(
+        username,
+        lambda _: ens_index.get_text(node, "avatar"),
+        avatar_cache,
+        registry_contract.functions.text(node, "avatar").call,
+    )
+    if not avatar_url:
+        # Fallback URL if avatar not set
+        return f"{AVATAR_FALLBACK_URL}/{username}"
+    return variant_url(avatar_url, size) if size else avatar_url
+
+
+def invalidate_registration(username: str, address: str) -> None:
+    """Drop every cached record a registration of `username` to `address` changes"""
+    available_cache.invalidate(username)
+    address_cache.invalidate(username)
+    username_cache.invalidate(Web3.to_checksum_address(address))
+
+
+def invalidate_until_mined(tx_hash: HexBytes, invalidate: Callable[[], None]) -> None:
+    """Invalidate cached records now, and again once `tx_hash` is mined"""
+    invalidate()
+    pending_invalidations[tx_hash.to_0x_hex()] = invalidate
+
+
+def transaction_finished(transaction: TrackedTransaction) -> None:
+    fee_oracle.observe(transaction.method, transaction.status, transaction.gas_used)
+    invalidate = pending_invalidations.pop(transaction.tx_hash, None)
+    if invalidate is not None and transaction.status == "confirmed":
+        invalidate()
+
+
 class RegisterRequest(BaseModel):
     username: str
     address: str
 
 
+class BulkRegisterRequest(BaseModel):
+    registrations: list[RegisterRequest] = Field(
+        ..., min_length=1, max_length=MAX_BULK_REGISTRATIONS
+    )
+
+
+class BulkRegisterResult(BaseModel):
+    username: str
+    address: str
+    status: Literal["submitted", "unavailable", "duplicate", "invalid", "failed"]
+    tx_hash: str | None = None
+    error: str | None = None
+
+
+class BulkRegisterResponse(BaseModel):
+    results: list[BulkRegisterResult]
+
+
 class CheckUsernameAvailableResponse(BaseModel):
     username: str
     available: bool
@@ -79,79 +445,272 @@ class GetAddressResponse(BaseModel):
     address: str
 
 
+class BatchAddressesRequest(BaseModel):
+    addresses: list[str] = Field(..., min_length=1, max_length=MAX_BATCH_LOOKUPS)
+
+
+class BatchUsernamesRequest(BaseModel):
+    usernames: list[str] = Field(..., min_length=1, max_length=MAX_BATCH_LOOKUPS)
+
+
+class BatchGetUsernamesResponse(BaseModel):
+    usernames: dict[str, str | None]
+
+
+class BatchGetAddressesResponse(BaseModel):
+    addresses: dict[str, str | None]
+
+
+class BatchGetAvatarsResponse(BaseModel):
+    avatars: dict[str, str]
+
+
+class SearchUsernamesResponse(BaseModel):
+    usernames: list[str]
+
+
 class TransactionResponse(BaseModel):
     tx_hash: str
 
 
+class ChangeAvatarResponse(BaseModel):
+    # None when the avatar was already set to this image
+    tx_hash: str | None
+    avatar_url: str
+
+
+class TransactionStatusResponse(BaseModel):
+    tx_hash: str
+    nonce: int
+    method: str
+    status: Literal["pending", "confirmed", "failed", "replaced"]
+    block_number: int | None
+    gas_used: int | None
+    submitted_at: float
+
+
 class AddCreditsRequest(BaseModel):
     address: str
     amount: float
 
 
+class BulkAddCreditsRequest(BaseModel):
+    grants: list[AddCreditsRequest] = Field(
+        ..., min_length=1, max_length=MAX_BULK_CREDIT_GRANTS
+    )
+
+
+class BulkAddCreditsResponse(BaseModel):
+    # Total amount added to each address
+    added: dict[str, float]
+
+
+class BatchGetCreditsResponse(BaseModel):
+    balances: dict[str, float]
+
+
 # Thirdweb webhook routes
 @app.post("/thirdweb/webhook", description="Receive webhooks from Thirdweb")
 async def thirdweb_webhook_route(
     request: Request,
-    payload: ThirdwebWebhookPayload,
     signature: str = Header(None, alias="X-Pay-Signature"),
     timestamp: str = Header(None, alias="X-Pay-Timestamp"),
-) -> dict[str, str]:
-    """Route wrapper for thirdweb webhook"""
-    return await thirdweb_webhook(request, payload, signature, timestamp)
+) -> dict[str, Any]:
+    """Route wrapper for thirdweb webhook, the body is read by the handler"""
+    return await thirdweb_webhook(request, webhook_queue, signature, timestamp)
 
 
 @app.get("/credits/{address}", description="Get credit balance for an address")
 async def get_credits_route(address: str) -> dict[str, Any]:
     """Route wrapper for getting credits"""
-    return await get_credits(address)
+    return await get_credits(credit_ledger, address)
+
+
+@app.get(
+    "/credits/{address}/stream",
+    description="Stream the credit balance of an address, then its changes",
+)
+async def stream_credits(address: str) -> StreamingResponse:
+    if not Web3.is_address(address):
+        raise HTTPException(status_code=400, detail="Invalid address")
+    return StreamingResponse(
+        credit_ledger.stream(Web3.to_checksum_address(address)),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
+    )
 
 
 @app.post("/credits/add", description="Add credits directly to an address balance")
 async def add_credits_route(request: AddCreditsRequest) -> dict[str, Any]:
     """Route to add credits directly to an address balance"""
-    return await add_credits_direct(request.address, request.amount)
+    return await add_credits_direct(credit_ledger, request.address, request.amount)
+
+
+@app.post(
+    "/credits/add/bulk",
+    description="Add credits to many addresses at once, all of them or none",
+)
+async def bulk_add_credits(req: BulkAddCreditsRequest) -> BulkAddCreditsResponse:
+    added = await add_credits_bulk(
+        credit_ledger, [(grant.address, grant.amount) for grant in req.grants]
+    )
+    return BulkAddCreditsResponse(added=added)
 
 
 @app.post("/register", description="Register an ENS subname")
-def register_username(req: RegisterRequest) -> TransactionResponse:
+async def register_username(req: RegisterRequest) -> TransactionResponse:
     try:
-        nonce = w3.eth.get_transaction_count(account.address)
-        txn = registrar_contract.functions.register(
-            req.username, Web3.to_checksum_address(req.address)
-        ).build_transaction(
-            {
-                "from": account.address,
-                "nonce": nonce,
-                "gas": 300000,
-                "gasPrice": w3.eth.gas_price,
-                "chainId": w3.eth.chain_id,
-            }
+        tx_hash = await submitter.submit(
+            registrar_contract.functions.register(
+                req.username, Web3.to_checksum_address(req.address)
+            )
+        )
+        invalidate_until_mined(
+            tx_hash, lambda: invalidate_registration(req.username, req.address)
         )
-
-        signed_txn = w3.eth.account.sign_transaction(txn, private_key=PRIVATE_KEY)
-        tx_hash = w3.eth.send_raw_transaction(signed_txn.raw_transaction)
         return TransactionResponse(tx_hash=tx_hash.hex())
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/register/bulk", description="Register many ENS subnames at once")
+async def bulk_register_usernames(req: BulkRegisterRequest) -> BulkRegisterResponse:
+    results = []
+    to_check = []
+    seen_usernames = set()
+    seen_addresses = set()
+    for registration in req.registrations:
+        result = BulkRegisterResult(
+            username=registration.username,
+            address=registration.address,
+            status="invalid",
+        )
+        results.append(result)
+        if len(registration.username) < MIN_USERNAME_LENGTH or not Web3.is_address(
+            registration.address
+        ):
+            result.error = "Invalid username or address"
+            continue
+
+        result.address = Web3.to_checksum_address(registration.address)
+        if result.username in seen_usernames or result.address in seen_addresses:
+            result.status = "duplicate"
+            continue
+        seen_usernames.add(result.username)
+        seen_addresses.add(result.address)
+        to_check.append(result)
+
+    try:
+        availabilities = await multicall.aggregate(
+            [registrar_contract.functions.available(r.username) for r in to_check]
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    to_register = []
+    for result, is_available in zip(to_check, availabilities):
+        if is_available is None:
+            result.status = "failed"
+            result.error = "Could not check availability"
+        elif not is_available:
+            result.status = "unavailable"
+        else:
+            to_register.append(result)
+
+    # Transactions are queued in order and pipelined by the submitter
+    tx_hashes = await asyncio.gather(
+        *(
+            submitter.submit(
+                registrar_contract.functions.register(r.username, r.address)
+            )
+            for r in to_register
+        ),
+        return_exceptions=True,
+    )
+    for result, tx_hash in zip(to_register, tx_hashes):
+        if isinstance(tx_hash, BaseException):
+            result.status = "failed"
+            result.error = str(tx_hash)
+        else:
+            result.status = "submitted"
+            result.tx_hash = tx_hash.hex()
+            invalidate_until_mined(
+                tx_hash,
+                partial(invalidate_registration, result.username, result.address),
+            )
+
+    return BulkRegisterResponse(results=results)
+
+
+@app.get(
+    "/tx/stream",
+    description="Stream the status changes of the transactions sent by the backend",
+)
+async def stream_transactions(tx_hash: str | None = None) -> StreamingResponse:
+    return StreamingResponse(
+        receipt_tracker.stream(tx_hash),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
+    )
+
+
+@app.get(
+    "/tx/{tx_hash}",
+    description="Get the status of a transaction sent by the backend",
+)
+async def get_transaction_status(tx_hash: str) -> TransactionStatusResponse:
+    transaction = receipt_tracker.get(tx_hash)
+    if transaction is None:
+        raise HTTPException(status_code=404, detail="Unknown transaction")
+    return TransactionStatusResponse(**asdict(transaction))
+
+
 @app.get("/available", description="Check if an ENS subname is available")
-def check_username_available(
+async def check_username_available(
     username: str = Query(..., min_length=1),
 ) -> CheckUsernameAvailableResponse:
     try:
-        is_available = registrar_contract.functions.available(username).call()
+        node = namehash(f"{username}.bedrock-app.eth")
+        if indexer.synced and ens_index.is_registered(node):
+            is_available = False
+        else:
+            is_available = await available_cache.get_or_load(
+                username, registrar_contract.functions.available(username).call
+            )
         return CheckUsernameAvailableResponse(username=username, available=is_available)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/usernames/search", description="Search registered usernames by prefix")
+async def search_usernames(
+    prefix: str = Query(..., min_length=1),
+    limit: int = Query(10, ge=1, le=MAX_SEARCH_RESULTS),
+) -> SearchUsernamesResponse:
+    # Only right after startup, while the index is being loaded
+    await username_search_ready.wait()
+    return SearchUsernamesResponse(usernames=username_search.search(prefix, limit))
+
+
+@app.get(
+    "/metrics",
+    description="Get the request and dependency metrics in Prometheus text format",
+    response_class=PlainTextResponse,
+)
+async def get_metrics() -> PlainTextResponse:
+    return PlainTextResponse(render(), media_type=CONTENT_TYPE)
+
+
 @app.get("/{address}", description="Get the ENS subname of an address")
-def get_username(address: str) -> GetUsernameResponse:
+async def get_username(address: str) -> GetUsernameResponse:
     try:
-        result = registrar_contract.functions.getUsername(
-            Web3.to_checksum_address(address)
-        ).call()
+        checksum_address = Web3.to_checksum_address(address)
+        result = await lookup(
+            checksum_address,
+            ens_index.get_username,
+            username_cache,
+            registrar_contract.functions.getUsername(checksum_address).call,
+        )
         return GetUsernameResponse(username=result)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -161,29 +720,172 @@ def get_username(address: str) -> GetUsernameResponse:
     "/username/{username}/address",
     description="Get the address of a username using the registry contract",
 )
-def get_address(username: str) -> GetAddressResponse:
+async def get_address(username: str) -> GetAddressResponse:
     try:
         node = namehash(f"{username}.bedrock-app.eth")
-        address = registry_contract.functions.addr(node).call()
+        address = await lookup(
+            username,
+            lambda _: ens_index.get_address(node),
+            address_cache,
+            registry_contract.functions.addr(node).call,
+        )
         return GetAddressResponse(address=address)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.get("/username/{username}/avatar", description="Get the avatar URL of a username")
-async def get_avatar(username: str) -> str:
+async def get_avatar(
+    username: str,
+    size: int | None = Query(
+        None, gt=0, description="Smallest width in pixels the image must have"
+    ),
+) -> str:
     try:
-        node = namehash(f"{username}.bedrock-app.eth")
+        return await avatar_url_of(username, size)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to get avatar: {str(e)}")
 
-        avatar_url = registry_contract.functions.text(node, "avatar").call()
-        if avatar_url:
-            return avatar_url
-        else:
-            # Fallback URL if avatar not set
-            return f"https://avatars.jakerunzer.com/{username}"
 
+@app.get(
+    "/username/{username}/avatar/image",
+    description="Get the avatar image of a username, served from a local cache",
+    response_class=FileResponse,
+)
+async def get_avatar_image(
+    username: str,
+    size: int | None = Query(
+        None, gt=0, description="Smallest width in pixels the image must have"
+    ),
+    if_none_match: str | None = Header(None),
+) -> Response:
+    try:
+        avatar_url = await avatar_url_of(username, size)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to get avatar: {str(e)}")
+    if not is_proxied(avatar_url):
+        # Left to the browser, the backend only fetches images from known hosts
+        if avatar_url.startswith(("https://", "http://")):
+            return RedirectResponse(avatar_url, status_code=307)
+        raise HTTPException(status_code=404, detail="Avatar not found")
+    try:
+        stored = await avatar_fetcher.get(avatar_url)
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=f"Failed to fetch avatar: {e}")
+
+    headers = {"ETag": stored.etag, "Cache-Control": AVATAR_IMAGE_CACHE_CONTROL}
+    if if_none_match is not None and (
+        if_none_match.strip() == "*"
+        or stored.etag
+        in (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
+    ):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(stored.path, media_type=stored.content_type, headers=headers)
+
+
+@app.get("/cache/stats", description="Get the hit and miss counters of the ENS cache")
+async def get_cache_stats() -> dict[str, dict[str, int]]:
+    return {
+        "available": available_cache.stats(),
+        "username": username_cache.stats(),
+        "address": address_cache.stats(),
+        "avatar": avatar_cache.stats(),
+    }
+
+
+@app.get("/rpc/stats", description="Get the health of every RPC endpoint")
+async def get_rpc_stats() -> list[dict[str, Any]]:
+    return rpc_pool.stats()
+
+
+@app.get(
+    "/webhooks/stats",
+    description="Get the number of queued, in progress and dead-lettered webhooks",
+)
+async def get_webhook_stats() -> dict[str, int]:
+    return webhook_queue.stats()
+
+
+@app.post("/batch/usernames", description="Get the ENS subnames of many addresses")
+async def batch_get_usernames(req: BatchAddressesRequest) -> BatchGetUsernamesResponse:
+    try:
+        addresses: list[str] = list(
+            dict.fromkeys(Web3.to_checksum_address(a) for a in req.addresses)
+        )
+        results = await lookup_many(
+            addresses,
+            ens_index.get_username,
+            username_cache,
+            lambda missing: multicall.aggregate(
+                [registrar_contract.functions.getUsername(a) for a in missing]
+            ),
+        )
+        return BatchGetUsernamesResponse(usernames=results)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/batch/addresses", description="Get the addresses of many usernames")
+async def batch_get_addresses(req: BatchUsernamesRequest) -> BatchGetAddressesResponse:
+    try:
+        usernames = list(dict.fromkeys(req.usernames))
+        results = await lookup_many(
+            usernames,
+            lambda u: ens_index.get_address(namehash(f"{u}.bedrock-app.eth")),
+            address_cache,
+            lambda missing: multicall.aggregate(
+                [
+                    registry_contract.functions.addr(namehash(f"{u}.bedrock-app.eth"))
+                    for u in missing
+                ]
+            ),
+        )
+        return BatchGetAddressesResponse(addresses=results)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/batch/avatars", description="Get the avatar URLs of many usernames")
+async def batch_get_avatars(
+    req: BatchUsernamesRequest,
+    size: int | None = Query(
+        None, gt=0, description="Smallest width in pixels the images must have"
+    ),
+) -> BatchGetAvatarsResponse:
+    try:
+        usernames = list(dict.fromkeys(req.usernames))
+        results = await lookup_many(
+            usernames,
+            lambda u: ens_index.get_text(namehash(f"{u}.bedrock-app.eth"), "avatar"),
+            avatar_cache,
+            lambda missing: multicall.aggregate(
+                [
+                    registry_contract.functions.text(
+                        namehash(f"{u}.bedrock-app.eth"), "avatar"
+                    )
+                    for u in missing
+                ]
+            ),
+        )
+        return BatchGetAvatarsResponse(
+            avatars={
+                # Same fallback as the single avatar route
+                username: (
+                    (variant_url(avatar_url, size) if size else avatar_url)
+                    if avatar_url
+                    else f"{AVATAR_FALLBACK_URL}/{username}"
+                )
+                for username, avatar_url in results.items()
+            }
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to get avatars: {str(e)}")
+
+
+@app.post("/batch/credits", description="Get the credit balances of many addresses")
+async def batch_get_credits(req: BatchAddressesRequest) -> BatchGetCreditsResponse:
+    balances = await get_credits_many(credit_ledger, req.addresses)
+    return BatchGetCreditsResponse(balances=balances)
 
 
 @app.post(
@@ -192,46 +894,63 @@ async def get_avatar(username: str) -> str:
 )
 async def change_avatar(
     username: str, file: UploadFile = File(...)
-) -> TransactionResponse:
-    url = "https://api.pinata.cloud/pinning/pinFileToIPFS"
-
-    data = aiohttp.FormData()
-    data.add_field(
-        name="file",
-        value=await file.read(),  # Read file contents
-        filename=file.filename,
-        content_type=file.content_type,
-    )
-
-    headers = {
-        "Authorization": f"Bearer {PINATA_JWT}",
-    }
+) -> ChangeAvatarResponse:
+    # The request size limit leaves room for the multipart headers
+    if file.size is not None and file.size > MAX_AVATAR_SIZE:
+        raise HTTPException(
+            status_code=413, detail=f"Avatar is larger than {MAX_AVATAR_SIZE} bytes"
+        )
 
-    async with aiohttp.ClientSession() as session:
-        async with session.post(url, data=data, headers=headers) as response:
-            response.raise_for_status()
-            result = await response.json()
-            image_url = f"https://gateway.pinata.cloud/ipfs/{result.get('IpfsHash')}"
+    node = namehash(f"{username}.bedrock-app.eth")
+
+    # Hashing a large upload takes a while, keep it off the event loop
+    local_cid = await asyncio.to_thread(file_cid, file.file)
+    cid = pin_index.get(local_cid)
+    if cid is None:
+        # The worker process opens the upload by name, the spooled upload has none
+        with tempfile.NamedTemporaryFile() as image_file:
+            await asyncio.to_thread(copy_upload, file.file, image_file)
+            try:
+                variants = await asyncio.get_running_loop().run_in_executor(
+                    get_image_pool(), make_variants, image_file.name
+                )
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+
+        # The original and its thumbnails are pinned together in a directory, the
+        # original streamed from the upload
+        await asyncio.to_thread(file.file.seek, 0)
+        cid = await pinata.pin_directory(
+            "avatar",
+            [(ORIGINAL_NAME, file.file, file.content_type)]
+            + [
+                (name, variant, AVATAR_CONTENT_TYPE)
+                for name, variant in variants.items()
+            ],
+        )
+        pin_index.add(local_cid, cid)
+    image_url = f"{gateway_url(cid)}/{ORIGINAL_NAME}"
 
     try:
-        nonce = w3.eth.get_transaction_count(account.address)
-        txn = registrar_contract.functions.setText(
-            namehash(f"{username}.bedrock-app.eth"),  # label
-            "avatar",  # key
-            image_url,  # value
-        ).build_transaction(
-            {
-                "from": account.address,
-                "nonce": nonce,
-                "gas": 300000,
-                "gasPrice": w3.eth.gas_price,
-                "chainId": w3.eth.chain_id,
-            }
+        current_url = await lookup(
+            username,
+            lambda _: ens_index.get_text(node, "avatar"),
+            avatar_cache,
+            registry_contract.functions.text(node, "avatar").call,
         )
-
-        signed_txn = w3.eth.account.sign_transaction(txn, private_key=PRIVATE_KEY)
-        tx_hash = w3.eth.send_raw_transaction(signed_txn.raw_transaction)
-        return TransactionResponse(tx_hash=tx_hash.hex())
+        if current_url == image_url:
+            return ChangeAvatarResponse(tx_hash=None, avatar_url=image_url)
+
+        tx_hash = await submitter.submit(
+            registrar_contract.functions.setText(
+                node,  # label
+                "avatar",  # key
+                image_url,  # value
+            )
+        )
+        invalidate_until_mined(tx_hash, lambda: avatar_cache.invalidate(username))
+        ens_index.forget_text(node, "avatar")
+        return ChangeAvatarResponse(tx_hash=tx_hash.hex(), avatar_url=image_url)
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
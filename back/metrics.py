@@ -0,0 +1,237 @@
+import time
+from bisect import bisect_left
+from collections.abc import Iterable
+from typing import Any
+
+from eth_typing import ABI
+from eth_utils import function_abi_to_4byte_selector
+
+# Upper bounds of the latency histogram buckets (seconds)
+LATENCY_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Counter:
+    def __init__(self, name: str, description: str, labels: tuple[str, ...]):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, labels: tuple[str, ...], amount: float = 1.0) -> None:
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.description}"
+        yield f"# TYPE {self.name} counter"
+        for labels, value in self._values.items():
+            yield f"{self.name}{_labels(self.labels, labels)} {value}"
+
+
+class Histogram:
+    """
+    Histogram with fixed buckets. Observing a value costs a binary search and a
+    few list updates, bucket counts are only made cumulative when rendered.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        labels: tuple[str, ...],
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.buckets = buckets
+        # Per label values: a count per bucket plus one for +Inf, then the sum
+        self._series: dict[tuple[str, ...], list[float]] = {}
+
+    def observe(self, labels: tuple[str, ...], value: float) -> None:
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0.0] * (len(self.buckets) + 2)
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.description}"
+        yield f"# TYPE {self.name} histogram"
+        for labels, series in self._series.items():
+            cumulative = 0.0
+            for bound, count in zip((*self.buckets, "+Inf"), series):
+                cumulative += count
+                yield (
+                    f"{self.name}_bucket"
+                    f"{_labels((*self.labels, 'le'), (*labels, str(bound)))} "
+                    f"{cumulative}"
+                )
+            yield f"{self.name}_sum{_labels(self.labels, labels)} {series[-1]}"
+            yield f"{self.name}_count{_labels(self.labels, labels)} {cumulative}"
+
+
+def _labels(names: tuple[str, ...], values: tuple[str, ...]) -> str:
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return f"{{{pairs}}}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+http_request_duration = Histogram(
+    "http_request_duration_seconds",
+    "Time spent answering HTTP requests, per route template",
+    ("method", "route", "status"),
+)
+http_event_streams = Counter(
+    "http_event_streams_total",
+    "Server-sent events streams opened, per route template",
+    ("route",),
+)
+dependency_request_duration = Histogram(
+    "dependency_request_duration_seconds",
+    "Time spent waiting on outbound calls, per dependency and operation",
+    ("dependency", "operation"),
+)
+dependency_errors = Counter(
+    "dependency_errors_total",
+    "Outbound calls that failed, per dependency and operation",
+    ("dependency", "operation"),
+)
+webhook_events = Counter(
+    "webhook_events_total",
+    "Webhooks processed in the background, per outcome",
+    ("outcome",),
+)
+
+METRICS: list[Counter | Histogram] = [
+    http_request_duration,
+    http_event_streams,
+    dependency_request_duration,
+    dependency_errors,
+    webhook_events,
+]
+
+
+def render() -> str:
+    return "\n".join(line for metric in METRICS for line in metric.render()) + "\n"
+
+
+class DependencyCall:
+    __slots__ = ("labels", "started", "error")
+
+    def __init__(self, dependency: str, operation: str) -> None:
+        self.labels = (dependency, operation)
+        self.error = False
+
+    def failed(self) -> None:
+        """Count the call as failed even though it did not raise"""
+        self.error = True
+
+    def __enter__(self) -> "DependencyCall":
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type: Any, exc: Any, traceback: Any) -> None:
+        dependency_request_duration.observe(
+            self.labels, time.perf_counter() - self.started
+        )
+        if exc_type is not None or self.error:
+            dependency_errors.inc(self.labels)
+
+
+def track(dependency: str, operation: str) -> DependencyCall:
+    """
+    Time an outbound call and count it as failed if it raises:
+
+        with track("aleph", "fetch_aggregate"):
+            await client.fetch_aggregate(...)
+    """
+    return DependencyCall(dependency, operation)
+
+
+# Contract function names by selector, to label eth_call requests
+_function_names: dict[str, str] = {}
+
+
+def name_contract_functions(abi: ABI) -> None:
+    """Label the eth_call requests to the functions of this ABI by their name"""
+    for entry in abi:
+        if entry["type"] == "function":
+            selector = "0x" + function_abi_to_4byte_selector(entry).hex()
+            _function_names[selector] = entry["name"]
+
+
+def rpc_operation(method: str, params: Any) -> str:
+    """The contract function for eth_call requests, the RPC method otherwise"""
+    if method == "eth_call" and params:
+        data = params[0].get("data") or params[0].get("input") or ""
+        return _function_names.get(str(data)[:10], method)
+    return method
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording the duration of every HTTP request, labelled by
+    the template of the route that answered it rather than its concrete path.
+    Server-sent events streams are only counted, their duration is the one of
+    the client connection.
+    """
+
+    def __init__(self, app: Any) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Any, receive: Any, send: Any) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        stream = False
+        started = time.perf_counter()
+
+        async def send_with_status(message: Any) -> None:
+            nonlocal status, stream
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                stream = any(
+                    name.lower() == b"content-type"
+                    and value.startswith(b"text/event-stream")
+                    for name, value in message.get("headers", ())
+                )
+                if stream:
+                    http_event_streams.inc((_route_path(scope),))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            if not stream:
+                http_request_duration.observe(
+                    (scope["method"], _route_path(scope), str(status)),
+                    time.perf_counter() - started,
+                )
+
+
+def _route_path(scope: Any) -> str:
+    # The router stores the matched route in the scope
+    route = scope.get("route")
+    return route.path if route is not None else "unmatched"
@@ -0,0 +1,96 @@
+"""
+One-off migration of the credit balances to the sharded layout.
+
+Copies every balance of the single BEDROCK_CREDIT_BALANCES aggregate to the shard
+of its address (BEDROCK_CREDIT_BALANCES_00 to _ff), one aggregate message per
+shard. The single aggregate is left as it is.
+
+Run it once, from the `back` directory and with the same configuration as the
+application, before deploying the version reading the shards:
+
+    python migrate_credit_shards.py [--dry-run] [--force]
+
+It stops when some shard already holds balances, unless given --force, in which
+case balances already in their shard are kept rather than overwritten.
+"""
+
+import argparse
+import asyncio
+from typing import Any
+
+import aiohttp
+
+from credits import (
+    CREDIT_BALANCES_KEY,
+    CREDIT_SHARD_KEYS,
+    create_aleph_client,
+    get_aleph_account,
+    shard_of,
+)
+
+# Number of shards fetched per request, to keep the query string short
+SHARDS_PER_REQUEST = 32
+
+
+async def fetch(client: Any, keys: list[str]) -> dict[str, dict[str, float]]:
+    try:
+        return await client.fetch_aggregates(
+            address=get_aleph_account().get_address(), keys=keys
+        )
+    except aiohttp.ClientResponseError as e:
+        if e.status != 404:
+            raise
+        return {}
+
+
+async def migrate(dry_run: bool, force: bool) -> None:
+    async with create_aleph_client() as client:
+        legacy = (await fetch(client, [CREDIT_BALANCES_KEY])).get(
+            CREDIT_BALANCES_KEY
+        ) or {}
+        print(f"{len(legacy)} balances in {CREDIT_BALANCES_KEY}")
+
+        existing: dict[str, dict[str, float]] = {}
+        for start in range(0, len(CREDIT_SHARD_KEYS), SHARDS_PER_REQUEST):
+            existing.update(
+                await fetch(
+                    client, CREDIT_SHARD_KEYS[start : start + SHARDS_PER_REQUEST]
+                )
+            )
+        existing = {key: balances for key, balances in existing.items() if balances}
+        if existing and not force:
+            raise SystemExit(
+                f"{len(existing)} shards already hold balances, "
+                "run again with --force to only copy the missing ones"
+            )
+
+        shards: dict[str, dict[str, float]] = {}
+        for address, balance in legacy.items():
+            key = shard_of(address)
+            if address not in existing.get(key, {}):
+                shards.setdefault(key, {})[address] = balance
+
+        for key, balances in sorted(shards.items()):
+            print(f"{key}: {len(balances)} balances")
+            if not dry_run:
+                await client.create_aggregate(key=key, content=balances)
+        print(
+            f"{'Would copy' if dry_run else 'Copied'} "
+            f"{sum(len(b) for b in shards.values())} balances to {len(shards)} shards"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--dry-run", action="store_true", help="only show what would be copied"
+    )
+    parser.add_argument(
+        "--force", action="store_true", help="run even if shards hold balances"
+    )
+    args = parser.parse_args()
+    asyncio.run(migrate(args.dry_run, args.force))
+
+
+if __name__ == "__main__":
+    main()
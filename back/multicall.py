@@ -0,0 +1,71 @@
+import asyncio
+import json
+import os
+from collections.abc import Sequence
+from typing import Any
+
+from web3 import AsyncWeb3, Web3
+from web3.contract.async_contract import AsyncContractFunction
+
+# Multicall3 is deployed at the same address on every supported chain, Base included
+# See: https://github.com/mds1/multicall3
+MULTICALL3_ADDRESS = "0xcA11bde05977b3631167028862bE2a173976CA11"
+
+# Maximum number of calls aggregated in a single eth_call
+MAX_CALLS_PER_BATCH = 500
+
+code_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+class Multicall:
+    """
+    Aggregates read-only contract calls through Multicall3's `aggregate3`.
+
+    Calls are sent in chunks of MAX_CALLS_PER_BATCH, each chunk being a single
+    eth_call. Calls are allowed to fail individually: a reverted call gives `None`
+    instead of failing the whole batch.
+    """
+
+    def __init__(self, w3: AsyncWeb3, address: str = MULTICALL3_ADDRESS) -> None:
+        self.w3 = w3
+        # Read on creation rather than on import, like the other ABIs
+        with open(os.path.join(code_dir, "abis", "multicall3.json"), "r") as abi_file:
+            abi = json.load(abi_file)
+        self.contract = w3.eth.contract(
+            address=Web3.to_checksum_address(address), abi=abi
+        )
+
+    async def aggregate(self, calls: Sequence[AsyncContractFunction]) -> list[Any]:
+        """Run all calls and return their decoded results in order"""
+        chunks = [
+            calls[start : start + MAX_CALLS_PER_BATCH]
+            for start in range(0, len(calls), MAX_CALLS_PER_BATCH)
+        ]
+        results = await asyncio.gather(*(self._aggregate_chunk(c) for c in chunks))
+        return [result for chunk_results in results for result in chunk_results]
+
+    async def _aggregate_chunk(
+        self, calls: Sequence[AsyncContractFunction]
+    ) -> list[Any]:
+        responses = await self.contract.functions.aggregate3(
+            [(call.address, True, call._encode_transaction_data()) for call in calls]
+        ).call()
+        return [
+            self._decode(call, success, return_data)
+            for call, (success, return_data) in zip(calls, responses)
+        ]
+
+    def _decode(
+        self, call: AsyncContractFunction, success: bool, return_data: bytes
+    ) -> Any:
+        if not success or not return_data:
+            return None
+
+        output_types = [output["type"] for output in call.abi.get("outputs", [])]
+        decoded = [
+            Web3.to_checksum_address(value) if output_type == "address" else value
+            for output_type, value in zip(
+                output_types, self.w3.codec.decode(output_types, return_data)
+            )
+        ]
+        return decoded[0] if len(decoded) == 1 else tuple(decoded)
@@ -0,0 +1,78 @@
+import os
+from collections.abc import Sequence
+from typing import BinaryIO
+
+import aiohttp
+
+from metrics import track
+
+PINATA_API_URL = os.getenv("PINATA_API_URL", "https://api.pinata.cloud")
+PINATA_PIN_FILE_URL = f"{PINATA_API_URL}/pinning/pinFileToIPFS"
+PINATA_GATEWAY_URL = "https://gateway.pinata.cloud/ipfs"
+
+# Maximum number of simultaneous connections to Pinata
+PINATA_POOL_SIZE = int(os.getenv("PINATA_POOL_SIZE", "8"))
+
+# Total time allowed for a single pinning request, uploads included (seconds)
+PINATA_TIMEOUT = float(os.getenv("PINATA_TIMEOUT", "120"))
+
+
+class PinataClient:
+    """
+    Pins files to IPFS through the Pinata API over a long-lived HTTP session.
+
+    Files are streamed from their file object into the multipart request body
+    chunk by chunk, so the memory used by an upload does not depend on its size.
+    """
+
+    def __init__(self, jwt: str | None) -> None:
+        self.jwt = jwt
+        self._session: aiohttp.ClientSession | None = None
+
+    def start(self) -> None:
+        """Open the HTTP session, must be called from the running event loop"""
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=PINATA_POOL_SIZE),
+                timeout=aiohttp.ClientTimeout(total=PINATA_TIMEOUT),
+                headers={"Authorization": f"Bearer {self.jwt}"},
+            )
+
+    async def stop(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def pin_directory(
+        self,
+        directory: str,
+        files: Sequence[tuple[str, BinaryIO | bytes, str | None]],
+    ) -> str:
+        """
+        Pin (name, content, content type) files together in a directory, returning
+        the CID of the directory
+        """
+        # Quoting would escape the slashes of the paths
+        data = aiohttp.FormData(quote_fields=False)
+        for name, value, content_type in files:
+            # Pinata builds the directory from the common prefix of the paths
+            data.add_field(
+                name="file",
+                value=value,
+                filename=f"{directory}/{name}",
+                content_type=content_type,
+            )
+        return await self._pin(data, "pin_directory")
+
+    async def _pin(self, data: aiohttp.FormData, operation: str) -> str:
+        if self._session is None:
+            raise RuntimeError("Pinata client is not started")
+        with track("pinata", operation):
+            async with self._session.post(PINATA_PIN_FILE_URL, data=data) as response:
+                response.raise_for_status()
+                result = await response.json()
+        return result["IpfsHash"]
+
+
+def gateway_url(cid: str) -> str:
+    return f"{PINATA_GATEWAY_URL}/{cid}"
@@ -0,0 +1,163 @@
+import asyncio
+import time
+from collections.abc import AsyncIterator, Callable
+from dataclasses import asdict, dataclass
+from typing import Any, Literal
+
+from hexbytes import HexBytes
+from web3 import AsyncWeb3
+
+from cache import TTLCache
+from events import Broadcaster, format_event
+
+# Delay between two receipt polls (seconds)
+RECEIPT_POLL_INTERVAL = 2.0
+
+# Maximum number of requests sent in a single JSON-RPC batch
+MAX_BATCH_SIZE = 100
+
+# How long the status of a finished transaction stays available (seconds)
+FINISHED_TRANSACTION_TTL = 3600
+
+# Maximum number of finished transactions kept in memory
+MAX_FINISHED_TRANSACTIONS = 10_000
+
+TransactionStatus = Literal["pending", "confirmed", "failed", "replaced"]
+
+
+@dataclass
+class TrackedTransaction:
+    tx_hash: str
+    nonce: int
+    method: str
+    status: TransactionStatus = "pending"
+    block_number: int | None = None
+    gas_used: int | None = None
+    submitted_at: float = 0.0
+
+
+class ReceiptTracker:
+    """
+    Watches the transactions sent by the backend until they are mined.
+
+    A single loop polls the receipts of every pending transaction in one JSON-RPC
+    batch, along with the account's mined nonce: a pending transaction whose nonce
+    was used without it getting a receipt on two polls in a row has been replaced.
+    A single poll is not enough, the node may count the block's nonces before it
+    serves its receipts. Status changes are published as `confirmed`, `failed` and
+    `replaced` events, keyed by hash.
+    """
+
+    def __init__(
+        self,
+        w3: AsyncWeb3,
+        address: str,
+        on_finished: Callable[[TrackedTransaction], None] | None = None,
+    ) -> None:
+        self.w3 = w3
+        self.address = address
+        # Called with every transaction that leaves the pending state
+        self.on_finished = on_finished
+        self.events = Broadcaster()
+        self._pending: dict[str, TrackedTransaction] = {}
+        # Pending transactions whose nonce was used without a receipt at last poll
+        self._maybe_replaced: set[str] = set()
+        self._finished = TTLCache(
+            ttl=FINISHED_TRANSACTION_TTL, max_size=MAX_FINISHED_TRANSACTIONS
+        )
+        self._task: asyncio.Task | None = None
+
+    def track(self, tx_hash: HexBytes, nonce: int, method: str) -> None:
+        transaction = TrackedTransaction(
+            tx_hash=tx_hash.to_0x_hex(),
+            nonce=nonce,
+            method=method,
+            submitted_at=time.time(),
+        )
+        self._pending[transaction.tx_hash] = transaction
+
+    def get(self, tx_hash: str) -> TrackedTransaction | None:
+        tx_hash = _normalize_hash(tx_hash)
+        return self._pending.get(tx_hash) or self._finished.get(tx_hash)
+
+    async def stream(self, tx_hash: str | None = None) -> AsyncIterator[str]:
+        """
+        Server-sent events for one transaction, or for all of them when `tx_hash`
+        is None. A transaction that already finished gets its final event at once.
+        """
+        if tx_hash is not None:
+            tx_hash = _normalize_hash(tx_hash)
+            transaction = self.get(tx_hash)
+            if transaction is not None and transaction.status != "pending":
+                yield format_event(transaction.status, asdict(transaction))
+                return
+
+        async for message in self.events.stream(tx_hash):
+            yield message
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self._poll()
+            except Exception as e:
+                print(f"Error polling transaction receipts: {e}")
+            await asyncio.sleep(RECEIPT_POLL_INTERVAL)
+
+    async def _poll(self) -> None:
+        pending = list(self._pending.values())
+        for start in range(0, len(pending), MAX_BATCH_SIZE):
+            await self._poll_batch(pending[start : start + MAX_BATCH_SIZE])
+
+    async def _poll_batch(self, pending: list[TrackedTransaction]) -> None:
+        responses: Any = await self.w3.provider.make_batch_request(
+            [("eth_getTransactionCount", [self.address, "latest"])]
+            + [("eth_getTransactionReceipt", [tx.tx_hash]) for tx in pending]
+        )
+        if not isinstance(responses, list):
+            raise ValueError(responses.get("error"))
+
+        mined_nonce = int(responses[0]["result"], 16)
+        for transaction, response in zip(pending, responses[1:]):
+            receipt = response.get("result")
+            if receipt is not None:
+                transaction.block_number = int(receipt["blockNumber"], 16)
+                transaction.gas_used = int(receipt["gasUsed"], 16)
+                self._finish(
+                    transaction,
+                    "confirmed" if int(receipt["status"], 16) == 1 else "failed",
+                )
+            elif transaction.nonce >= mined_nonce:
+                self._maybe_replaced.discard(transaction.tx_hash)
+            elif transaction.tx_hash in self._maybe_replaced:
+                self._finish(transaction, "replaced")
+            else:
+                self._maybe_replaced.add(transaction.tx_hash)
+
+    def _finish(
+        self, transaction: TrackedTransaction, status: TransactionStatus
+    ) -> None:
+        transaction.status = status
+        del self._pending[transaction.tx_hash]
+        self._maybe_replaced.discard(transaction.tx_hash)
+        self._finished.set(transaction.tx_hash, transaction)
+        self.events.publish(status, asdict(transaction), key=transaction.tx_hash)
+        if self.on_finished is not None:
+            self.on_finished(transaction)
+
+
+def _normalize_hash(tx_hash: str) -> str:
+    tx_hash = tx_hash.lower()
+    return tx_hash if tx_hash.startswith("0x") else f"0x{tx_hash}"
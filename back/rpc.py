@@ -0,0 +1,336 @@
+import asyncio
+import os
+import time
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass
+from typing import Any
+
+import aiohttp
+from web3 import AsyncHTTPProvider, AsyncWeb3
+from web3.providers.async_base import AsyncBaseProvider
+from web3.types import RPCEndpoint, RPCResponse
+
+from metrics import rpc_operation, track
+
+# Maximum number of simultaneous connections to the RPC endpoints
+RPC_POOL_SIZE = int(os.getenv("RPC_POOL_SIZE", "32"))
+
+# Total time allowed for a single RPC request (seconds)
+RPC_TIMEOUT = float(os.getenv("RPC_TIMEOUT", "10"))
+
+# How long an idle connection is kept open for reuse (seconds)
+RPC_KEEPALIVE_TIMEOUT = 30.0
+
+
+def create_rpc_session() -> aiohttp.ClientSession:
+    """Create the HTTP session shared by every RPC request of the application"""
+    return aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(
+            limit=RPC_POOL_SIZE,
+            keepalive_timeout=RPC_KEEPALIVE_TIMEOUT,
+            ttl_dns_cache=300,
+        ),
+        timeout=aiohttp.ClientTimeout(total=RPC_TIMEOUT),
+    )
+
+
+async def attach_rpc_session(w3: AsyncWeb3, session: aiohttp.ClientSession) -> None:
+    """Make the Web3 provider send its requests through the given session"""
+    await w3.provider.cache_async_session(session)  # type: ignore[attr-defined]
+
+
+# Number of endpoints a transaction is broadcast to
+RPC_BROADCAST_COUNT = int(os.getenv("RPC_BROADCAST_COUNT", "3"))
+
+# Weight of the latest sample in the rolling latency and error rate averages
+RPC_EWMA_WEIGHT = 0.2
+
+# Consecutive failures after which an endpoint is taken out of rotation
+RPC_MAX_FAILURES = 3
+
+# How long an endpoint stays out of rotation after failing (seconds)
+RPC_COOLDOWN = 30.0
+
+# Delay between two health probes of every endpoint (seconds)
+RPC_PROBE_INTERVAL = 10.0
+
+# Endpoints further behind the highest known head are not used for reads
+RPC_MAX_LAG_BLOCKS = 5
+
+# Methods sent to several endpoints at once rather than to the fastest one
+WRITE_METHODS = {"eth_sendRawTransaction"}
+
+
+@dataclass
+class _Endpoint:
+    provider: AsyncHTTPProvider
+    # Rolling average of successful request durations (seconds)
+    latency: float | None = None
+    # Rolling share of requests failing at the transport level
+    error_rate: float = 0.0
+    failures: int = 0
+    down_until: float = 0.0
+    head: int | None = None
+    requests: int = 0
+    errors: int = 0
+
+    @property
+    def url(self) -> str:
+        return str(self.provider.endpoint_uri)
+
+    @property
+    def score(self) -> float:
+        # Expected cost of a request: a failure costs up to the full timeout
+        return (self.latency or 0.0) + self.error_rate * RPC_TIMEOUT
+
+    def succeeded(self, duration: float) -> None:
+        self.requests += 1
+        self.failures = 0
+        self.latency = (
+            duration
+            if self.latency is None
+            else (1 - RPC_EWMA_WEIGHT) * self.latency + RPC_EWMA_WEIGHT * duration
+        )
+        self.error_rate *= 1 - RPC_EWMA_WEIGHT
+
+    def failed(self) -> None:
+        self.requests += 1
+        self.errors += 1
+        self.failures += 1
+        self.error_rate = (1 - RPC_EWMA_WEIGHT) * self.error_rate + RPC_EWMA_WEIGHT
+        if self.failures >= RPC_MAX_FAILURES:
+            self.down_until = time.monotonic() + RPC_COOLDOWN
+
+
+class RpcPool(AsyncBaseProvider):
+    """
+    Web3 provider spreading requests over several RPC endpoints.
+
+    Every endpoint keeps a rolling average of its latency and transport error
+    rate. Reads go to the endpoint with the lowest expected cost and fail over to
+    the next one when a request cannot be completed. Endpoints failing
+    RPC_MAX_FAILURES times in a row, or lagging behind the others' head, are left
+    out of rotation until they recover.
+
+    Transactions are broadcast to the RPC_BROADCAST_COUNT best endpoints at once;
+    the first successful answer is returned without waiting for the slower nodes.
+    JSON-RPC error responses are answers, not endpoint failures, and are passed
+    through untouched.
+    """
+
+    def __init__(self, urls: list[str]) -> None:
+        super().__init__()
+        if not urls:
+            raise ValueError("At least one RPC URL is required")
+        self.endpoints = [
+            # Retries are replaced by failing over to another endpoint
+            _Endpoint(AsyncHTTPProvider(url, exception_retry_configuration=None))
+            for url in urls
+        ]
+        self._prober: asyncio.Task | None = None
+        # Keeps a reference to broadcasts still running after their first answer
+        self._background: set[asyncio.Task] = set()
+
+    def __str__(self) -> str:
+        return f"RPC pool of {len(self.endpoints)} endpoints"
+
+    async def cache_async_session(self, session: aiohttp.ClientSession) -> None:
+        for endpoint in self.endpoints:
+            await endpoint.provider.cache_async_session(session)
+
+    def start(self) -> None:
+        if self._prober is None and len(self.endpoints) > 1:
+            self._prober = asyncio.create_task(self._probe_loop())
+
+    async def stop(self) -> None:
+        if self._prober is not None:
+            self._prober.cancel()
+            try:
+                await self._prober
+            except asyncio.CancelledError:
+                pass
+            self._prober = None
+        for task in list(self._background):
+            task.cancel()
+
+    def stats(self) -> list[dict[str, Any]]:
+        now = time.monotonic()
+        return [
+            {
+                "url": endpoint.url,
+                "healthy": self._healthy(endpoint, now),
+                "latency": endpoint.latency,
+                "error_rate": endpoint.error_rate,
+                "requests": endpoint.requests,
+                "errors": endpoint.errors,
+                "head": endpoint.head,
+            }
+            for endpoint in self.endpoints
+        ]
+
+    async def is_connected(self, show_traceback: bool = False) -> bool:
+        for endpoint in self._ranked():
+            if await endpoint.provider.is_connected(show_traceback):
+                return True
+        return False
+
+    async def make_request(self, method: RPCEndpoint, params: Any) -> RPCResponse:
+        with track("rpc", rpc_operation(method, params)) as call:
+            if method in WRITE_METHODS:
+                response = await self._broadcast(
+                    lambda provider: provider.make_request(method, params)
+                )
+            else:
+                response = await self._failover(
+                    lambda provider: provider.make_request(method, params)
+                )
+            if _has_error(response):
+                call.failed()
+        return response
+
+    async def make_batch_request(
+        self, requests: list[tuple[RPCEndpoint, Any]]
+    ) -> list[RPCResponse] | RPCResponse:
+        operation = "batch:" + "+".join(sorted({method for method, _ in requests}))
+        with track("rpc", operation) as call:
+            if any(method in WRITE_METHODS for method, _ in requests):
+                response = await self._broadcast(
+                    lambda provider: provider.make_batch_request(requests)
+                )
+            else:
+                response = await self._failover(
+                    lambda provider: provider.make_batch_request(requests)
+                )
+            if _has_error(response):
+                call.failed()
+        return response
+
+    def _healthy(self, endpoint: _Endpoint, now: float) -> bool:
+        if endpoint.down_until > now:
+            return False
+        heads = [e.head for e in self.endpoints if e.head is not None]
+        return endpoint.head is None or endpoint.head >= max(heads) - RPC_MAX_LAG_BLOCKS
+
+    def _ranked(self) -> list[_Endpoint]:
+        """Healthy endpoints from fastest to slowest, then the unhealthy ones"""
+        now = time.monotonic()
+        return sorted(
+            self.endpoints,
+            key=lambda endpoint: (not self._healthy(endpoint, now), endpoint.score),
+        )
+
+    async def _call(
+        self,
+        endpoint: _Endpoint,
+        request: Callable[[AsyncHTTPProvider], Awaitable[Any]],
+    ) -> Any:
+        started = time.perf_counter()
+        try:
+            response = await request(endpoint.provider)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            endpoint.failed()
+            raise
+        endpoint.succeeded(time.perf_counter() - started)
+        return response
+
+    async def _failover(
+        self, request: Callable[[AsyncHTTPProvider], Awaitable[Any]]
+    ) -> Any:
+        error: Exception | None = None
+        for endpoint in self._ranked():
+            try:
+                return await self._call(endpoint, request)
+            except Exception as e:
+                print(f"RPC request to {endpoint.url} failed: {e}")
+                error = e
+        assert error is not None
+        raise error
+
+    async def _broadcast(
+        self, request: Callable[[AsyncHTTPProvider], Awaitable[Any]]
+    ) -> Any:
+        tasks = [
+            asyncio.create_task(self._call(endpoint, request))
+            for endpoint in self._ranked()[:RPC_BROADCAST_COUNT]
+        ]
+        # Answers in the order they arrived
+        responses: list[Any] = []
+        error: Exception | None = None
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                if task.exception() is not None:
+                    error = task.exception()  # type: ignore[assignment]
+                else:
+                    responses.append(task.result())
+            merged = _merge_responses(responses)
+            if merged is not None and not _has_error(merged):
+                break
+
+        # Let the slower endpoints finish receiving the transaction
+        for task in pending:
+            self._background.add(task)
+            task.add_done_callback(self._background.discard)
+            task.add_done_callback(_ignore_result)
+
+        if not responses:
+            assert error is not None
+            raise error
+        return _merge_responses(responses)
+
+    async def _probe_loop(self) -> None:
+        while True:
+            await asyncio.gather(
+                *(self._probe(endpoint) for endpoint in self.endpoints)
+            )
+            await asyncio.sleep(RPC_PROBE_INTERVAL)
+
+    async def _probe(self, endpoint: _Endpoint) -> None:
+        """Refresh the latency and head of an endpoint, even out of rotation"""
+        try:
+            response = await self._call(
+                endpoint,
+                lambda provider: provider.make_request(
+                    RPCEndpoint("eth_blockNumber"), []
+                ),
+            )
+            endpoint.head = int(response["result"], 16)
+        except Exception:
+            endpoint.head = None
+
+
+def _has_error(response: list[RPCResponse] | RPCResponse) -> bool:
+    if isinstance(response, list):
+        return any("error" in item for item in response)
+    return "error" in response
+
+
+def _merge_responses(
+    responses: list[list[RPCResponse] | RPCResponse],
+) -> list[RPCResponse] | RPCResponse | None:
+    """
+    Combine the answers of several endpoints to the same request, keeping for
+    every item the first successful answer, or the first error if none succeeded.
+    """
+    if not responses:
+        return None
+    batches = [response for response in responses if isinstance(response, list)]
+    if not batches:
+        return next(
+            (response for response in responses if "error" not in response),
+            responses[0],
+        )
+    return [
+        next((item for item in items if "error" not in item), items[0])
+        for items in zip(*batches)
+    ]
+
+
+def _ignore_result(task: asyncio.Task) -> None:
+    if not task.cancelled():
+        task.exception()
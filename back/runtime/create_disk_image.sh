@@ -37,7 +37,7 @@ locale-gen en_US.UTF-8
 echo "Pip installing aleph-sdk-python"
 mkdir -p /opt/aleph/libs
 # Fixing this protobuf dependency version to avoid getting CI errors as version 5.29.0 have this compilation issue.
-pip3 install --target /opt/aleph/libs 'aleph-sdk-python==2.0.2' 'aleph-message==1.0.0' 'fastapi~=0.109.2' 'protobuf==5.28.3' 'web3==7.12.0' 'python-dotenv==1.1.0' 'eth-account==0.13.7' 'python-multipart==0.0.20'
+pip3 install --target /opt/aleph/libs 'aleph-sdk-python==2.0.2' 'aleph-message==1.0.0' 'fastapi~=0.109.2' 'protobuf==5.28.3' 'web3==7.12.0' 'python-dotenv==1.1.0' 'eth-account==0.13.7' 'python-multipart==0.0.20' 'pillow==12.3.0'
 
 # Compile Python code to bytecode for faster execution
 # -o2 is needed to compile with optimization level 2 which is what we launch init1.py ("python -OO")
@@ -79,25 +79,31 @@ class RunCodePayload:
     scope: dict
 
 
-# Open a socket to receive instructions from the host
-s = socket.socket(socket.AF_VSOCK, socket.SOCK_STREAM)
-s.bind((socket.VMADDR_CID_ANY, 52))
-s.listen()
+def connect_to_host() -> socket.socket:
+    """
+    Open the socket receiving instructions from the host and tell it that we are ready.
+    Only called from `main`: processes spawned by the app import this file again.
+    """
+    # Open a socket to receive instructions from the host
+    s = socket.socket(socket.AF_VSOCK, socket.SOCK_STREAM)
+    s.bind((socket.VMADDR_CID_ANY, 52))
+    s.listen()
 
-# Send the host that we are ready
-s0 = socket.socket(socket.AF_VSOCK, socket.SOCK_STREAM)
-s0.connect((2, 52))
-s0.sendall(msgpack.dumps({"version": __version__}))
-s0.close()
+    # Send the host that we are ready
+    s0 = socket.socket(socket.AF_VSOCK, socket.SOCK_STREAM)
+    s0.connect((2, 52))
+    s0.sendall(msgpack.dumps({"version": __version__}))
+    s0.close()
 
-# Configure aleph-client to use the guest API
-os.environ["ALEPH_INIT_VERSION"] = __version__
-os.environ["ALEPH_API_HOST"] = "http://localhost"
-os.environ["ALEPH_API_UNIX_SOCKET"] = "/tmp/socat-socket"
-os.environ["ALEPH_REMOTE_CRYPTO_HOST"] = "http://localhost"
-os.environ["ALEPH_REMOTE_CRYPTO_UNIX_SOCKET"] = "/tmp/socat-socket"
+    # Configure aleph-client to use the guest API
+    os.environ["ALEPH_INIT_VERSION"] = __version__
+    os.environ["ALEPH_API_HOST"] = "http://localhost"
+    os.environ["ALEPH_API_UNIX_SOCKET"] = "/tmp/socat-socket"
+    os.environ["ALEPH_REMOTE_CRYPTO_HOST"] = "http://localhost"
+    os.environ["ALEPH_REMOTE_CRYPTO_UNIX_SOCKET"] = "/tmp/socat-socket"
 
-logger.debug("init1.py is launching")
+    logger.debug("init1.py is launching")
+    return s
 
 
 def setup_hostname(hostname: str):
@@ -186,35 +192,76 @@ def setup_volumes(volumes: list[Volume]):
     system("mount")
 
 
-async def wait_for_lifespan_event_completion(application: ASGIApplication, event: Literal["startup", "shutdown"]):
+class Lifespan:
     """
-    Send the startup lifespan signal to the ASGI app.
+    Lifespan of an ASGI app, from its startup to its shutdown.
     Specification: https://asgi.readthedocs.io/en/latest/specs/lifespan.html
-    """
 
-    lifespan_completion = asyncio.Event()
+    The app handles its whole lifespan in a single call: after the startup, it waits
+    on `receive()` for the shutdown. That call keeps running in the background until
+    the VM halts, since the app stops everything it started as soon as it returns.
+    """
 
-    async def receive():
-        return {
-            "type": f"lifespan.{event}",
+    def __init__(self, application: ASGIApplication):
+        self.application = application
+        self.events: asyncio.Queue[str] = asyncio.Queue()
+        self.completions: dict[str, asyncio.Future] = {
+            "startup": asyncio.get_running_loop().create_future(),
+            "shutdown": asyncio.get_running_loop().create_future(),
         }
-
-    async def send(response: dict):
-        response_type = response.get("type")
-        if response_type == f"lifespan.{event}.complete":
-            lifespan_completion.set()
-            return
+        self.task: asyncio.Task | None = None
+
+    async def receive(self) -> dict:
+        return {"type": f"lifespan.{await self.events.get()}"}
+
+    async def send(self, response: dict):
+        response_type = response.get("type", "")
+        event, _, outcome = response_type.removeprefix("lifespan.").partition(".")
+        completion = self.completions.get(event)
+        if completion is None or completion.done():
+            logger.warning(f"Unexpected lifespan response: {response_type}")
+        elif outcome == "complete":
+            completion.set_result(None)
+        elif outcome == "failed":
+            message = response.get("message") or f"Application {event} failed"
+            completion.set_exception(RuntimeError(message))
         else:
-            logger.warning(f"Unexpected response to {event}: {response_type}")
-
-    while not lifespan_completion.is_set():
-        await application(
-            scope={
-                "type": "lifespan",
-            },
-            receive=receive,
-            send=send,
-        )
+            logger.warning(f"Unexpected lifespan response: {response_type}")
+
+    async def run(self):
+        try:
+            await self.application({"type": "lifespan"}, self.receive, self.send)
+        except Exception:
+            logger.exception("Application lifespan failed")
+        finally:
+            # Apps without lifespan support return or raise right away
+            for completion in self.completions.values():
+                if not completion.done():
+                    completion.set_result(None)
+
+    async def wait_for(self, event: Literal["startup", "shutdown"]):
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+        await self.events.put(event)
+        await self.completions[event]
+        if event == "shutdown":
+            await self.task
+
+
+# Lifespans of the ASGI apps, running from their startup to their shutdown
+lifespans: dict[ASGIApplication, Lifespan] = {}
+
+
+async def wait_for_lifespan_event_completion(application: ASGIApplication, event: Literal["startup", "shutdown"]):
+    """
+    Send a lifespan signal to the ASGI app and wait for the app to handle it.
+    Specification: https://asgi.readthedocs.io/en/latest/specs/lifespan.html
+    """
+    if event == "startup":
+        lifespans[application] = Lifespan(application)
+        await lifespans[application].wait_for(event)
+    elif (lifespan := lifespans.pop(application, None)) is not None:
+        await lifespan.wait_for(event)
 
 
 async def setup_code_asgi(code: bytes, encoding: Encoding, entrypoint: str) -> ASGIApplication:
@@ -529,6 +576,7 @@ def umount_volumes(volumes: list[Volume]):
 
 
 async def main() -> None:
+    s = connect_to_host()
     client, addr = s.accept()
 
     logger.debug("Receiving setup...")
@@ -0,0 +1,45 @@
+from bisect import bisect_left
+from collections.abc import Iterable
+
+
+class PrefixIndex:
+    """
+    Sorted array of usernames answering prefix queries with a binary search.
+
+    Matching is case-insensitive: entries are kept as `(lowercase, username)` pairs
+    sorted by their lowercase form, so all the usernames sharing a prefix are
+    contiguous and a query only walks the results it returns.
+    """
+
+    def __init__(self) -> None:
+        self._entries: list[tuple[str, str]] = []
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def add(self, username: str) -> None:
+        entry = (username.lower(), username)
+        position = bisect_left(self._entries, entry)
+        if position == len(self._entries) or self._entries[position] != entry:
+            self._entries.insert(position, entry)
+
+    def add_many(self, usernames: Iterable[str]) -> None:
+        entries = [(username.lower(), username) for username in usernames]
+        if len(entries) > len(self._entries):
+            # Cheaper to sort everything once than to insert entries one by one
+            self._entries = sorted(set(self._entries).union(entries))
+        else:
+            for _, username in entries:
+                self.add(username)
+
+    def search(self, prefix: str, limit: int) -> list[str]:
+        prefix = prefix.lower()
+        results: list[str] = []
+        position = bisect_left(self._entries, (prefix,))
+        while position < len(self._entries) and len(results) < limit:
+            key, username = self._entries[position]
+            if not key.startswith(prefix):
+                break
+            results.append(username)
+            position += 1
+        return results
@@ -0,0 +1,16 @@
+import os
+import sqlite3
+
+code_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Directory holding the local SQLite databases of the backend
+DATA_DIR = os.getenv("DATA_DIR") or os.path.join(code_dir, "data")
+
+
+def connect(name: str) -> sqlite3.Connection:
+    """Open a SQLite database from the data directory in WAL mode"""
+    os.makedirs(DATA_DIR, exist_ok=True)
+    conn = sqlite3.connect(os.path.join(DATA_DIR, name), check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
@@ -0,0 +1,33 @@
+from collections.abc import AsyncIterator, Awaitable, Callable
+
+import pytest
+from aiohttp import web
+
+import storage
+
+# Starts an aiohttp application on a free local port, returning its URL
+Serve = Callable[[web.Application], Awaitable[str]]
+
+
+@pytest.fixture
+async def serve() -> AsyncIterator[Serve]:
+    runners: list[web.AppRunner] = []
+
+    async def start(app: web.Application) -> str:
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", 0).start()
+        runners.append(runner)
+        host, port = runner.addresses[0][:2]
+        return f"http://{host}:{port}"
+
+    yield start
+    for runner in runners:
+        await runner.cleanup()
+
+
+@pytest.fixture(autouse=True)
+def data_dir(tmp_path, monkeypatch) -> str:
+    """Keep the SQLite databases of every test in a directory of its own"""
+    monkeypatch.setattr(storage, "DATA_DIR", str(tmp_path))
+    return str(tmp_path)
@@ -0,0 +1,149 @@
+import asyncio
+import sqlite3
+from collections.abc import AsyncIterator
+from typing import Any
+
+import pytest
+from aleph.sdk.conf import settings
+from mocks import aleph_app
+from web3 import Web3
+
+import credits
+from conftest import Serve
+from credits import CreditLedger, shard_of
+from storage import connect
+
+ALICE = Web3.to_checksum_address("0x" + "a1" * 20)
+BOB = Web3.to_checksum_address("0x" + "b2" * 20)
+
+
+@pytest.fixture(autouse=True)
+async def aleph(serve: Serve, monkeypatch) -> AsyncIterator[None]:
+    monkeypatch.setattr(settings, "API_HOST", await serve(aleph_app(0)))
+    monkeypatch.setattr(credits, "ALEPH_PRIVATE_KEY", bytes.fromhex("11" * 32))
+    credits.get_aleph_account.cache_clear()
+    yield
+    credits.get_aleph_account.cache_clear()
+
+
+@pytest.fixture
+async def ledger() -> AsyncIterator[CreditLedger]:
+    ledger = CreditLedger(connect("credits.sqlite3"))
+    yield ledger
+    await ledger.stop()
+
+
+async def published(key: str) -> dict[str, float]:
+    """Balances of a shard as Aleph serves them, read by another ledger"""
+    reader = CreditLedger(sqlite3.connect(":memory:"))
+    try:
+        return await reader.refresh(key)
+    finally:
+        await reader.stop()
+
+
+async def test_credit_is_recorded_once(ledger: CreditLedger) -> None:
+    assert ledger.credit("0xpayment", ALICE, 5.0)
+    assert not ledger.credit("0xpayment", ALICE, 5.0)
+
+    assert await ledger.balance(ALICE) == 5.0
+
+
+async def test_credit_many_is_all_or_nothing(ledger: CreditLedger) -> None:
+    ledger.credit("0xfirst", ALICE, 1.0)
+
+    # An amount SQLite cannot store fails the whole batch
+    invalid: Any = object()
+    with pytest.raises(sqlite3.Error):
+        ledger.credit_many([("0xsecond", ALICE, 2.0), ("0xthird", BOB, invalid)])
+
+    assert await ledger.balances([ALICE, BOB]) == {ALICE: 1.0, BOB: 0.0}
+    assert ledger.credit_many([("0xfirst", ALICE, 1.0), ("0xsecond", ALICE, 2.0)]) == [
+        False,
+        True,
+    ]
+
+
+async def test_credit_many_in_thread_skips_known_events(ledger: CreditLedger) -> None:
+    ledger.credit("0xfirst", ALICE, 1.0)
+
+    credited = await ledger.credit_many_in_thread(
+        [("0xfirst", ALICE, 1.0), ("0xsecond", BOB, 2.0), ("0xsecond", BOB, 2.0)]
+    )
+
+    assert credited == [False, True, False]
+    assert await ledger.balances([ALICE, BOB]) == {ALICE: 1.0, BOB: 2.0}
+
+
+async def test_flush_publishes_balances_on_top_of_aleph(ledger: CreditLedger) -> None:
+    # Balance published before the address was ever credited locally
+    await ledger._post(shard_of(ALICE), {ALICE: 10.0})
+    ledger.credit("0xalice", ALICE, 5.0)
+    ledger.credit("0xbob", BOB, 2.0)
+
+    await ledger.flush()
+
+    assert await published(shard_of(ALICE)) == {ALICE: 15.0}
+    assert await published(shard_of(BOB)) == {BOB: 2.0}
+    assert await ledger.balances([ALICE, BOB]) == {ALICE: 15.0, BOB: 2.0}
+
+
+async def test_flush_publishes_every_changed_shard(
+    ledger: CreditLedger, monkeypatch
+) -> None:
+    monkeypatch.setattr(credits, "CREDITS_PUBLISH_CONCURRENCY", 2)
+    addresses = [Web3.to_checksum_address(f"0x{i:02x}" + "00" * 19) for i in range(10)]
+    ledger.credit_many([(address, address, 1.0) for address in addresses])
+
+    await ledger.flush()
+
+    for address in addresses:
+        assert await published(shard_of(address)) == {address: 1.0}
+
+
+async def test_unpublished_credits_are_published_after_a_restart() -> None:
+    ledger = CreditLedger(connect("credits.sqlite3"))
+    ledger.credit("0xalice", ALICE, 3.0)
+    # Stopped without publishing
+    ledger.conn.close()
+
+    restarted = CreditLedger(connect("credits.sqlite3"))
+    try:
+        await restarted.flush()
+    finally:
+        await restarted.stop()
+
+    assert await published(shard_of(ALICE)) == {ALICE: 3.0}
+
+
+async def test_credits_are_streamed(ledger: CreditLedger) -> None:
+    # Async generator, closed once done
+    stream: Any = ledger.stream(ALICE)
+    assert '"balance": 0.0' in await anext(stream)
+
+    # Credited before the client reads again
+    ledger.credit("0xalice", ALICE, 4.0)
+    event = await asyncio.wait_for(anext(stream), 1)
+
+    assert event.startswith("event: balance\n")
+    assert '"balance": 4.0' in event
+    await stream.aclose()
+
+
+async def test_credit_during_the_first_read_is_streamed(
+    ledger: CreditLedger, monkeypatch
+) -> None:
+    read_balance = ledger.balance
+
+    async def balance(address: str) -> float:
+        value = await read_balance(address)
+        # Credited while the balance was downloaded
+        ledger.credit("0xalice", ALICE, 4.0)
+        return value
+
+    monkeypatch.setattr(ledger, "balance", balance)
+    stream: Any = ledger.stream(ALICE)
+    assert '"balance": 0.0' in await anext(stream)
+
+    assert '"balance": 4.0' in await asyncio.wait_for(anext(stream), 1)
+    await stream.aclose()
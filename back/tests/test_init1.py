@@ -0,0 +1,63 @@
+import asyncio
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from typing import Any
+
+import pytest
+from aleph.sdk.conf import settings
+from fastapi import FastAPI
+from init1 import ASGIApplication, wait_for_lifespan_event_completion
+from load_test import SIGNER_KEY
+from mocks import START_BLOCK, aleph_app, chain_app
+
+import indexer
+import main
+from conftest import Serve
+
+
+async def test_app_keeps_running_until_shutdown(serve: Serve, monkeypatch) -> None:
+    monkeypatch.setattr(main, "BASE_RPC_URL", await serve(chain_app(0, 10)))
+    monkeypatch.setattr(main, "PRIVATE_KEY", SIGNER_KEY)
+    monkeypatch.setattr(settings, "API_HOST", await serve(aleph_app(0)))
+    monkeypatch.setattr(indexer, "INDEXER_START_BLOCK", START_BLOCK)
+
+    app = ASGIApplication(main.app)
+    await wait_for_lifespan_event_completion(app, "startup")
+    await asyncio.wait_for(main.username_search_ready.wait(), 5)
+    # Give the background tasks time to fail, if they are to
+    await asyncio.sleep(0.1)
+
+    tasks = [
+        main.submitter._sender,
+        main.receipt_tracker._task,
+        main.credit_ledger._task,
+        main.indexer._task,
+        *main.webhook_queue._tasks,
+    ]
+    assert all(task is not None and not task.done() for task in tasks)
+    assert main.pinata._session is not None
+
+    await wait_for_lifespan_event_completion(app, "shutdown")
+    assert main.submitter._sender is None
+    assert main.webhook_queue._tasks == []
+    assert main.pinata._session is None
+
+
+async def test_failed_startup_raises() -> None:
+    @asynccontextmanager
+    async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+        raise ValueError("No configuration")
+        yield
+
+    app = ASGIApplication(FastAPI(lifespan=lifespan))
+    with pytest.raises(RuntimeError, match="No configuration"):
+        await wait_for_lifespan_event_completion(app, "startup")
+
+
+async def test_app_without_lifespan_starts_and_stops() -> None:
+    async def http_only(scope: dict[str, Any], receive: Any, send: Any) -> None:
+        assert scope["type"] == "http"
+
+    app = ASGIApplication(http_only)
+    await wait_for_lifespan_event_completion(app, "startup")
+    await wait_for_lifespan_event_completion(app, "shutdown")
@@ -0,0 +1,44 @@
+import io
+
+import pytest
+
+from ipfs import CHUNK_SIZE, PinIndex, file_cid
+from storage import connect
+
+
+@pytest.mark.parametrize(
+    ("content", "cid"),
+    [
+        # `ipfs add` of an empty file
+        (b"", "QmbFMke1KXqnYyBBWxB74N4c5SBnJMVAiMNRcGu6x1AwQH"),
+        # `echo "hello world" | ipfs add`
+        (b"hello world\n", "QmT78zSuBmuS4z925WZfrqQ1qHaJ56DQaTfyMUF7F8ff5o"),
+        (b"hello world", "Qmf412jQZiuVUtdgnB36FXFX7xg5V6KEbSJ4dpQuhkLyfD"),
+    ],
+)
+def test_file_cid_matches_ipfs_add(content: bytes, cid: str) -> None:
+    assert file_cid(io.BytesIO(content)) == cid
+
+
+def test_file_cid_reads_from_the_current_position() -> None:
+    file = io.BytesIO(b"header" + b"hello world\n")
+    file.seek(len(b"header"))
+    assert file_cid(file) == "QmT78zSuBmuS4z925WZfrqQ1qHaJ56DQaTfyMUF7F8ff5o"
+
+
+def test_file_cid_links_the_chunks_of_large_files() -> None:
+    chunk = b"\x01" * CHUNK_SIZE
+    single = file_cid(io.BytesIO(chunk))
+    double = file_cid(io.BytesIO(chunk * 2))
+
+    assert double != single
+    # Only the content counts, not how it is read
+    assert file_cid(io.BufferedReader(io.BytesIO(chunk * 2), 1000)) == double
+
+
+def test_pin_index_remembers_pinned_uploads() -> None:
+    index = PinIndex(connect("pins.sqlite3"))
+    assert index.get("QmLocal") is None
+
+    index.add("QmLocal", "QmPinned")
+    assert index.get("QmLocal") == "QmPinned"
@@ -0,0 +1,45 @@
+from collections.abc import AsyncIterator
+
+import httpx
+import pytest
+
+import main
+from main import MAX_AVATAR_SIZE, MULTIPART_OVERHEAD
+
+ORIGIN = "https://bedrock.example"
+
+
+@pytest.fixture
+async def client() -> AsyncIterator[httpx.AsyncClient]:
+    # Answered by the middlewares, the application does not need to be started
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        yield client
+
+
+async def test_large_avatar_is_rejected_from_its_length(
+    client: httpx.AsyncClient,
+) -> None:
+    response = await client.post(
+        "/username/alice/avatar",
+        content=b" " * (MAX_AVATAR_SIZE + MULTIPART_OVERHEAD + 1),
+        headers={"Origin": ORIGIN},
+    )
+
+    assert response.status_code == 413
+    assert response.headers["access-control-allow-origin"] == "*"
+
+
+async def test_avatar_without_length_is_rejected(client: httpx.AsyncClient) -> None:
+    received = 0
+
+    async def chunks() -> AsyncIterator[bytes]:
+        nonlocal received
+        for _ in range(4):
+            received += 1
+            yield b" " * 16384
+
+    response = await client.post("/username/alice/avatar", content=chunks())
+
+    assert response.status_code == 411
+    assert received == 0
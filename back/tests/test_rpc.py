@@ -0,0 +1,234 @@
+import asyncio
+import time
+from collections.abc import AsyncIterator, Awaitable, Callable
+from typing import Any
+
+import pytest
+from aiohttp import web
+from web3.types import RPCEndpoint
+
+import rpc
+from conftest import Serve
+from rpc import RpcPool, _merge_responses, create_rpc_session
+
+TRANSACTION_HASH = "0x" + "ab" * 32
+
+
+class Node:
+    """JSON-RPC endpoint at block `head`, answering after `latency` seconds"""
+
+    def __init__(
+        self, head: int = 100, latency: float = 0.0, error: str | None = None
+    ) -> None:
+        self.head = head
+        self.latency = latency
+        # Error answered to transactions, instead of their hash
+        self.error = error
+        # Answers HTTP errors while down
+        self.down = False
+        self.requests = 0
+        self.methods: list[str] = []
+        self.transactions: list[str] = []
+
+    def app(self) -> web.Application:
+        async def handle(request: web.Request) -> web.Response:
+            self.requests += 1
+            body = await request.json()
+            await asyncio.sleep(self.latency)
+            if self.down:
+                raise web.HTTPServiceUnavailable()
+            if isinstance(body, list):
+                return web.json_response([self.answer(item) for item in body])
+            return web.json_response(self.answer(body))
+
+        app = web.Application()
+        app.router.add_post("/", handle)
+        return app
+
+    def answer(self, request: dict[str, Any]) -> dict[str, Any]:
+        method = request["method"]
+        self.methods.append(method)
+        response: dict[str, Any] = {"jsonrpc": "2.0", "id": request["id"]}
+        if method == "eth_blockNumber":
+            response["result"] = hex(self.head)
+        elif method == "eth_sendRawTransaction":
+            self.transactions.append(request["params"][0])
+            if self.error is not None:
+                response["error"] = {"code": -32000, "message": self.error}
+            else:
+                response["result"] = TRANSACTION_HASH
+        else:
+            response["result"] = "0x1"
+        return response
+
+
+PoolOf = Callable[..., Awaitable[RpcPool]]
+
+
+@pytest.fixture
+async def pool_of(serve: Serve) -> AsyncIterator[PoolOf]:
+    session = create_rpc_session()
+    pools = []
+
+    async def create(*nodes: Node) -> RpcPool:
+        pool = RpcPool([await serve(node.app()) for node in nodes])
+        await pool.cache_async_session(session)
+        pools.append(pool)
+        return pool
+
+    yield create
+    for pool in pools:
+        await pool.stop()
+    await session.close()
+
+
+async def probe(pool: RpcPool) -> None:
+    await asyncio.gather(*(pool._probe(endpoint) for endpoint in pool.endpoints))
+
+
+async def call(pool: RpcPool, method: str, params: Any = None) -> Any:
+    return await pool.make_request(RPCEndpoint(method), params or [])
+
+
+async def test_reads_go_to_the_fastest_endpoint(pool_of: PoolOf) -> None:
+    slow, fast = Node(latency=0.05), Node()
+    pool = await pool_of(slow, fast)
+    await probe(pool)
+
+    assert (await call(pool, "eth_chainId"))["result"] == "0x1"
+    assert "eth_chainId" in fast.methods
+    assert "eth_chainId" not in slow.methods
+
+
+async def test_failover_to_the_next_endpoint(pool_of: PoolOf) -> None:
+    failing, working = Node(), Node()
+    failing.down = True
+    pool = await pool_of(failing, working)
+
+    assert (await call(pool, "eth_chainId"))["result"] == "0x1"
+    assert failing.requests == 1
+    assert working.methods == ["eth_chainId"]
+    assert pool.endpoints[0].failures == 1
+
+
+async def test_error_answers_are_not_endpoint_failures(pool_of: PoolOf) -> None:
+    pool = await pool_of(Node(error="insufficient funds for gas"))
+
+    response = await call(pool, "eth_sendRawTransaction", ["0x01"])
+    assert response["error"]["message"] == "insufficient funds for gas"
+    assert pool.endpoints[0].failures == 0
+
+
+async def test_failing_endpoint_cools_down(pool_of: PoolOf, monkeypatch) -> None:
+    monkeypatch.setattr(rpc, "RPC_COOLDOWN", 0.2)
+    failing, slow = Node(), Node()
+    failing.down = True
+    pool = await pool_of(failing, slow)
+    # Slow enough that the failing endpoint keeps being tried first
+    pool.endpoints[1].latency = 1000.0
+
+    for _ in range(rpc.RPC_MAX_FAILURES):
+        await call(pool, "eth_chainId")
+    assert failing.requests == rpc.RPC_MAX_FAILURES
+    assert not pool.stats()[0]["healthy"]
+
+    # Out of rotation, even once it works again
+    failing.down = False
+    await call(pool, "eth_chainId")
+    assert failing.requests == rpc.RPC_MAX_FAILURES
+
+    await asyncio.sleep(0.2)
+    assert pool.stats()[0]["healthy"]
+    await call(pool, "eth_chainId")
+    assert failing.methods == ["eth_chainId"]
+
+
+async def test_lagging_endpoint_is_not_used_for_reads(pool_of: PoolOf) -> None:
+    lagging, synced = Node(head=100 - rpc.RPC_MAX_LAG_BLOCKS - 1), Node(latency=0.05)
+    pool = await pool_of(lagging, synced)
+    await probe(pool)
+    assert [stats["healthy"] for stats in pool.stats()] == [False, True]
+
+    await call(pool, "eth_chainId")
+    assert "eth_chainId" not in lagging.methods
+
+    lagging.head = 100
+    await probe(pool)
+    await call(pool, "eth_chainId")
+    assert "eth_chainId" in lagging.methods
+
+
+async def test_broadcast_returns_the_first_answer(pool_of: PoolOf) -> None:
+    slow, fast = Node(latency=0.5), Node()
+    pool = await pool_of(slow, fast)
+
+    started = time.perf_counter()
+    response = await call(pool, "eth_sendRawTransaction", ["0x01"])
+    assert response["result"] == TRANSACTION_HASH
+    assert time.perf_counter() - started < 0.5
+    assert fast.transactions == ["0x01"]
+
+    # The slower endpoint still gets the transaction
+    await asyncio.sleep(0.6)
+    assert slow.transactions == ["0x01"]
+
+
+async def test_broadcast_waits_for_a_success(pool_of: PoolOf) -> None:
+    rejecting, slow = Node(error="nonce too low"), Node(latency=0.1)
+    pool = await pool_of(rejecting, slow)
+
+    response = await call(pool, "eth_sendRawTransaction", ["0x01"])
+    assert response["result"] == TRANSACTION_HASH
+
+
+async def test_broadcast_passes_errors_through(pool_of: PoolOf) -> None:
+    pool = await pool_of(Node(error="nonce too low"), Node(error="nonce too low"))
+
+    response = await call(pool, "eth_sendRawTransaction", ["0x01"])
+    assert response["error"]["message"] == "nonce too low"
+
+
+async def test_broadcast_raises_when_no_endpoint_answers(pool_of: PoolOf) -> None:
+    nodes = [Node(), Node()]
+    for node in nodes:
+        node.down = True
+    pool = await pool_of(*nodes)
+
+    with pytest.raises(Exception):
+        await call(pool, "eth_sendRawTransaction", ["0x01"])
+
+
+async def test_batch_broadcast_merges_answers(pool_of: PoolOf) -> None:
+    pool = await pool_of(Node(error="already known"), Node(latency=0.1))
+
+    responses: Any = await pool.make_batch_request(
+        [
+            (RPCEndpoint("eth_sendRawTransaction"), ["0x01"]),
+            (RPCEndpoint("eth_sendRawTransaction"), ["0x02"]),
+        ]
+    )
+    assert [response["result"] for response in responses] == [TRANSACTION_HASH] * 2
+
+
+def test_merge_responses_of_single_requests() -> None:
+    error: Any = {"jsonrpc": "2.0", "id": 1, "error": {"code": -32000, "message": "x"}}
+    success: Any = {"jsonrpc": "2.0", "id": 1, "result": "0x1"}
+
+    assert _merge_responses([]) is None
+    assert _merge_responses([error, success]) == success
+    assert _merge_responses([error]) == error
+
+
+def test_merge_responses_of_batches_item_by_item() -> None:
+    def response(id: int, result: str | None) -> Any:
+        if result is None:
+            return {"jsonrpc": "2.0", "id": id, "error": {"code": -32000}}
+        return {"jsonrpc": "2.0", "id": id, "result": result}
+
+    merged = _merge_responses(
+        [
+            [response(1, None), response(2, "0x2"), response(3, None)],
+            [response(1, "0x1"), response(2, None), response(3, None)],
+        ]
+    )
+    assert merged == [response(1, "0x1"), response(2, "0x2"), response(3, None)]
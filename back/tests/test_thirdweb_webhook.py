@@ -0,0 +1,192 @@
+import asyncio
+import hashlib
+import hmac
+import json
+import time
+from collections.abc import AsyncIterator
+from typing import Any
+
+import httpx
+import pytest
+from fastapi import FastAPI, Header, Request
+
+import thirdweb_webhook
+from credits import CreditLedger
+from storage import connect
+from thirdweb_webhook import MAX_WEBHOOK_BODY_SIZE, process_webhook
+from webhook_queue import WebhookQueue
+
+SECRET = "webhook-secret"
+PAYMENT_PROCESSOR_ADDRESS = "0x" + "50" * 20
+BUYER_ADDRESS = "0x" + "b2" * 20
+
+
+def payment(transaction_hash: str = "0x" + "aa" * 32) -> bytes:
+    details = {
+        "transactionHash": transaction_hash,
+        "amountWei": "10000000000000000000",
+        "amount": "10",
+        "amountUSDCents": 1000,
+        "completedAt": "2025-01-01T00:00:00Z",
+    }
+    return json.dumps(
+        {
+            "data": {
+                "buyWithCryptoStatus": {
+                    "swapType": "SAME_CHAIN",
+                    "source": details,
+                    "status": "COMPLETED",
+                    "toAddress": PAYMENT_PROCESSOR_ADDRESS,
+                    "destination": details,
+                    "purchaseData": {"userAddress": BUYER_ADDRESS},
+                }
+            }
+        }
+    ).encode()
+
+
+def signed(body: bytes, secret: str = SECRET, age: int = 0) -> dict[str, str]:
+    timestamp = str(int(time.time()) - age)
+    signature = hmac.new(
+        secret.encode(), timestamp.encode() + b"." + body, hashlib.sha256
+    ).hexdigest()
+    return {"X-Pay-Signature": signature, "X-Pay-Timestamp": timestamp}
+
+
+@pytest.fixture(autouse=True)
+def configuration(monkeypatch) -> None:
+    monkeypatch.setattr(thirdweb_webhook, "THIRDWEB_WEBHOOK_SECRET", SECRET)
+    monkeypatch.setattr(
+        thirdweb_webhook, "PAYMENT_PROCESSOR_ADDRESS", PAYMENT_PROCESSOR_ADDRESS
+    )
+
+
+@pytest.fixture
+async def queue() -> AsyncIterator[WebhookQueue]:
+    async def handler(body: str) -> None:
+        # Never done, so that handled webhooks stay queued
+        await asyncio.Event().wait()
+
+    queue = WebhookQueue(connect("webhooks.sqlite3"), handler)
+    queue.start()
+    yield queue
+    await queue.stop()
+
+
+@pytest.fixture
+async def client(queue: WebhookQueue) -> AsyncIterator[httpx.AsyncClient]:
+    app = FastAPI()
+
+    @app.post("/thirdweb/webhook")
+    async def route(
+        request: Request,
+        signature: str = Header(None, alias="X-Pay-Signature"),
+        timestamp: str = Header(None, alias="X-Pay-Timestamp"),
+    ) -> dict[str, Any]:
+        return await thirdweb_webhook.thirdweb_webhook(
+            request, queue, signature, timestamp
+        )
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        yield client
+
+
+async def test_signed_webhook_is_queued(
+    client: httpx.AsyncClient, queue: WebhookQueue
+) -> None:
+    body = payment()
+    response = await client.post(
+        "/thirdweb/webhook", content=body, headers=signed(body)
+    )
+
+    assert response.status_code == 200
+    assert response.json() == {"status": "queued", "transaction_hash": "0x" + "aa" * 32}
+    assert queue.stats()["queued"] == 1
+
+
+async def test_webhook_is_not_acknowledged_without_workers(
+    client: httpx.AsyncClient, queue: WebhookQueue
+) -> None:
+    await queue.stop()
+    body = payment()
+    response = await client.post(
+        "/thirdweb/webhook", content=body, headers=signed(body)
+    )
+
+    # Retried by thirdweb later on
+    assert response.status_code == 503
+    assert queue.stats()["queued"] == 0
+
+
+@pytest.mark.parametrize(
+    "headers",
+    [
+        # Signed with another secret
+        signed(payment(), secret="other-secret"),
+        # Signed for another body
+        signed(payment("0x" + "bb" * 32)),
+        # Signed too long ago
+        signed(payment(), age=thirdweb_webhook.MAX_WEBHOOK_AGE + 60),
+        {"X-Pay-Timestamp": str(int(time.time()))},
+        {"X-Pay-Signature": "00" * 32},
+    ],
+)
+async def test_unsigned_webhook_is_rejected(
+    client: httpx.AsyncClient, queue: WebhookQueue, headers: dict[str, str]
+) -> None:
+    response = await client.post(
+        "/thirdweb/webhook", content=payment(), headers=headers
+    )
+
+    assert response.status_code == 401
+    assert queue.stats()["queued"] == 0
+
+
+async def test_unsupported_webhook_is_rejected(
+    client: httpx.AsyncClient, queue: WebhookQueue
+) -> None:
+    body = json.dumps({"data": {"onrampStatus": {}}}).encode()
+    response = await client.post(
+        "/thirdweb/webhook", content=body, headers=signed(body)
+    )
+
+    assert response.status_code == 400
+    assert queue.stats()["queued"] == 0
+
+
+async def test_large_body_is_rejected_from_its_length(
+    client: httpx.AsyncClient, queue: WebhookQueue
+) -> None:
+    body = b" " * (MAX_WEBHOOK_BODY_SIZE + 1)
+    response = await client.post(
+        "/thirdweb/webhook", content=body, headers=signed(body)
+    )
+
+    assert response.status_code == 413
+    assert queue.stats()["queued"] == 0
+
+
+async def test_large_body_without_length_is_rejected(
+    client: httpx.AsyncClient, queue: WebhookQueue
+) -> None:
+    async def chunks() -> AsyncIterator[bytes]:
+        for _ in range(4 * MAX_WEBHOOK_BODY_SIZE // 16384):
+            yield b" " * 16384
+
+    response = await client.post(
+        "/thirdweb/webhook", content=chunks(), headers=signed(b"")
+    )
+
+    assert response.status_code == 413
+    assert queue.stats()["queued"] == 0
+
+
+async def test_payment_is_credited_once() -> None:
+    ledger = CreditLedger(connect("credits.sqlite3"))
+    body = payment().decode()
+
+    assert (await process_webhook(ledger, body))["status"] == "success"
+    assert (await process_webhook(ledger, body))["status"] == "ignored"
+    (credited,) = ledger.conn.execute("SELECT credited FROM credit_balances").fetchone()
+    assert credited == 10.0
@@ -0,0 +1,157 @@
+import asyncio
+from collections.abc import AsyncIterator, Awaitable
+from typing import Any
+
+import pytest
+from eth_account import Account
+from eth_account.typed_transactions import TypedTransaction
+from eth_utils import keccak
+from hexbytes import HexBytes
+from web3.exceptions import Web3RPCError
+
+from transactions import TransactionSubmitter
+
+CHAIN_ID = 8453
+CONTRACT_ADDRESS = "0x" + "11" * 20
+
+
+class Node:
+    """Node holding the signer account, mining every transaction it accepts"""
+
+    def __init__(self) -> None:
+        self.eth = self
+        self.provider = self
+        # Next nonce of the account
+        self.nonce = 0
+        # Error answered once to the transaction of a nonce
+        self.errors: dict[int, str] = {}
+        # Requests fail at the transport level while down
+        self.down = False
+        # Nonces and hashes of the mined transactions
+        self.mined: list[tuple[int, str]] = []
+
+    @property
+    def chain_id(self) -> Awaitable[int]:
+        return asyncio.sleep(0, CHAIN_ID)
+
+    async def get_transaction_count(self, address: str, block: str) -> int:
+        return self.nonce
+
+    async def make_batch_request(
+        self, requests: list[tuple[str, Any]]
+    ) -> list[dict[str, Any]]:
+        if self.down:
+            raise ConnectionError("Node unreachable")
+        return [self._send(params[0]) for _, params in requests]
+
+    def _send(self, raw_transaction: str) -> dict[str, Any]:
+        transaction = TypedTransaction.from_bytes(HexBytes(raw_transaction))
+        nonce = transaction.as_dict()["nonce"]
+        error = self.errors.pop(nonce, None)
+        if error is None and nonce != self.nonce:
+            error = "nonce too low" if nonce < self.nonce else "nonce too high"
+        if error is not None:
+            return {
+                "jsonrpc": "2.0",
+                "id": 1,
+                "error": {"code": -32000, "message": error},
+            }
+
+        tx_hash = "0x" + keccak(HexBytes(raw_transaction)).hex()
+        self.nonce += 1
+        self.mined.append((nonce, tx_hash))
+        return {"jsonrpc": "2.0", "id": 1, "result": tx_hash}
+
+
+class Fees:
+    def gas_limit(self, method: str) -> int:
+        return 100_000
+
+    async def fees(self) -> dict[str, int]:
+        return {"maxFeePerGas": 10**7, "maxPriorityFeePerGas": 10**6}
+
+
+class Call:
+    """Contract function call"""
+
+    fn_name = "register"
+
+    async def build_transaction(self, params: dict[str, Any]) -> dict[str, Any]:
+        return {"to": CONTRACT_ADDRESS, "value": 0, "data": "0x", **params}
+
+
+@pytest.fixture
+def node() -> Node:
+    return Node()
+
+
+@pytest.fixture
+async def submitter(node: Node) -> AsyncIterator[TransactionSubmitter]:
+    w3: Any = node
+    fee_oracle: Any = Fees()
+    submitter = TransactionSubmitter(w3, Account.create(), fee_oracle)
+    submitter.start()
+    yield submitter
+    await submitter.stop()
+
+
+async def submit(submitter: TransactionSubmitter) -> str:
+    function: Any = Call()
+    return (await submitter.submit(function)).to_0x_hex()
+
+
+async def test_concurrent_transactions_get_consecutive_nonces(
+    node: Node, submitter: TransactionSubmitter
+) -> None:
+    node.nonce = 7
+    sent = []
+    submitter.on_sent = lambda tx_hash, nonce, method: sent.append(
+        (nonce, tx_hash.to_0x_hex())
+    )
+
+    tx_hashes = await asyncio.gather(*(submit(submitter) for _ in range(5)))
+
+    assert [nonce for nonce, _ in node.mined] == [7, 8, 9, 10, 11]
+    assert [tx_hash for _, tx_hash in node.mined] == tx_hashes
+    assert sent == node.mined
+
+
+async def test_nonce_error_resyncs_and_sends_again(
+    node: Node, submitter: TransactionSubmitter
+) -> None:
+    await submit(submitter)
+    # The account sent transactions from somewhere else
+    node.nonce += 2
+
+    tx_hash = await submit(submitter)
+    assert node.mined[-1] == (3, tx_hash)
+
+    # The nonce stays in sync afterwards
+    await submit(submitter)
+    assert node.mined[-1][0] == 4
+
+
+async def test_rejected_transaction_does_not_block_the_next_ones(
+    node: Node, submitter: TransactionSubmitter
+) -> None:
+    node.errors[0] = "insufficient funds for gas"
+
+    results = await asyncio.gather(
+        *(submit(submitter) for _ in range(3)), return_exceptions=True
+    )
+
+    assert isinstance(results[0], Web3RPCError)
+    # Signed again with the nonces left unused by the rejected one
+    assert node.mined == [(0, results[1]), (1, results[2])]
+
+
+async def test_unreachable_node_fails_the_batch_and_resyncs(
+    node: Node, submitter: TransactionSubmitter
+) -> None:
+    node.down = True
+    with pytest.raises(ConnectionError):
+        await submit(submitter)
+
+    node.down = False
+    tx_hash = await submit(submitter)
+    assert node.mined == [(0, tx_hash)]
@@ -2,30 +2,28 @@ import hashlib
 import hmac
 import os
 import time
+import uuid
 from typing import Any, Dict, Literal
 
-from aleph.sdk import AuthenticatedAlephHttpClient
-from aleph.sdk.chains.ethereum import ETHAccount
 from dotenv import load_dotenv
 from fastapi import HTTPException, Header, Request
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, ValidationError
 from web3 import Web3
 
+from credits import CreditLedger
+from webhook_queue import WebhookQueue
+
 load_dotenv()
 
 # Configuration
 THIRDWEB_WEBHOOK_SECRET = os.getenv("THIRDWEB_WEBHOOK_SECRET", "")
 PAYMENT_PROCESSOR_ADDRESS = os.getenv("PAYMENT_PROCESSOR_ADDRESS", "")
-ALEPH_PRIVATE_KEY: bytes = os.getenv(  # type: ignore
-    "ALEPH_PRIVATE_KEY",
-    os.getenv("BEDROCK_PRIVATE_KEY"),  # type: ignore
-)
 
 # Maximum age of webhook in seconds before rejecting it (5 minutes)
 MAX_WEBHOOK_AGE = 300
 
-# Initialize Aleph client
-aleph_account = ETHAccount(ALEPH_PRIVATE_KEY)
+# Largest webhook body accepted (bytes), payment webhooks are a few kilobytes
+MAX_WEBHOOK_BODY_SIZE = 64 * 1024
 
 
 # Models
@@ -60,65 +58,36 @@ class ThirdwebWebhookPayload(BaseModel):
         return None
 
 
-# Aleph functions
-async def get_credit_balance(address: str) -> float:
-    """Get credit balance for an address from Aleph aggregate"""
-    try:
-        async with AuthenticatedAlephHttpClient(
-            account=aleph_account,
-        ) as client:
-            response = await client.fetch_aggregate(
-                address=aleph_account.get_address(), key="BEDROCK_CREDIT_BALANCES"
-            )
-        return response.get(address, 0.0)
-    except Exception:
-        return 0.0
-
-
-async def update_credit_balance(address: str, amount: float) -> None:
-    """Update credit balance for an address on Aleph aggregate"""
-    try:
-        async with AuthenticatedAlephHttpClient(
-            account=aleph_account,
-        ) as client:
-            current_balances = {}
-            try:
-                response = await client.fetch_aggregate(
-                    address=aleph_account.get_address(), key="BEDROCK_CREDIT_BALANCES"
-                )
-                if response.get("credit_balances"):
-                    current_balances = response["credit_balances"]
-            except Exception:
-                pass
-
-            # Update balance
-            current_balance = current_balances.get(address, 0.0)
-            new_balance = current_balance + amount
-            current_balances[address] = new_balance
-
-            # Post updated balances to Aleph
-            await client.create_aggregate(
-                key="BEDROCK_CREDIT_BALANCES",
-                content=current_balances,
-            )
-    except Exception as e:
-        print(f"Error updating credit balance: {e}")
-        raise
+async def read_body(request: Request, max_size: int) -> bytes:
+    """Receive a request body, rejecting it as soon as it exceeds `max_size`"""
+    content_length = request.headers.get("content-length", "")
+    if content_length.isdigit() and int(content_length) > max_size:
+        raise HTTPException(status_code=413, detail="Webhook body too large")
+
+    # Bodies sent without a Content-Length are measured while received
+    body = bytearray()
+    async for chunk in request.stream():
+        body += chunk
+        if len(body) > max_size:
+            raise HTTPException(status_code=413, detail="Webhook body too large")
+    return bytes(body)
 
 
 # Webhook endpoint
 async def thirdweb_webhook(
     request: Request,
-    payload: ThirdwebWebhookPayload,
+    queue: WebhookQueue,
     signature: str = Header(None, alias="X-Pay-Signature"),
     timestamp: str = Header(None, alias="X-Pay-Timestamp"),
 ) -> Dict[str, Any]:
     """
-    Process webhooks from Thirdweb.
+    Receive webhooks from Thirdweb.
     Currently only supports buyWithCryptoStatus events.
 
     Verifies the webhook signature using the THIRDWEB_WEBHOOK_SECRET and validates
-    the timestamp to prevent replay attacks.
+    the timestamp to prevent replay attacks, then queues the webhook to be
+    processed by `process_webhook` in the background. The body is only parsed
+    once its signature is verified.
     """
     # Verify the webhook signature
     if not signature:
@@ -142,26 +111,44 @@ async def thirdweb_webhook(
     except ValueError:
         raise HTTPException(status_code=401, detail="Invalid timestamp format")
 
-    # Get raw request body for signature verification
-    body = await request.body()
-    body_str = body.decode("utf-8")
+    # Raw request body, signed as received
+    body = await read_body(request, MAX_WEBHOOK_BODY_SIZE)
 
-    # Combine timestamp and body to create the payload for signature verification
-    signature_payload = f"{timestamp}.{body_str}"
-
-    # Calculate expected signature
+    # Calculate expected signature over the timestamp and the body
     expected_signature = hmac.new(
-        THIRDWEB_WEBHOOK_SECRET.encode(), signature_payload.encode(), hashlib.sha256
+        THIRDWEB_WEBHOOK_SECRET.encode(),
+        timestamp.encode() + b"." + body,
+        hashlib.sha256,
     ).hexdigest()
 
     # Secure comparison to prevent timing attacks
-    if not hmac.compare_digest(expected_signature, signature):
+    if not hmac.compare_digest(expected_signature.encode(), signature.encode()):
         raise HTTPException(status_code=401, detail="Invalid signature")
 
-    data = payload.buy_with_crypto_status
+    try:
+        data = ThirdwebWebhookPayload.model_validate_json(body).buy_with_crypto_status
+    except ValidationError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid webhook: {e}")
     if data is None:
         raise HTTPException(status_code=400, detail="Unsupported webhook type")
 
+    # Thirdweb stops retrying a webhook once it is acknowledged, so this only
+    # happens while the workers are there to credit it
+    if not queue.running:
+        raise HTTPException(status_code=503, detail="Webhook processing is stopped")
+
+    # Acknowledged once stored, whatever the state of Aleph. Valid JSON, hence
+    # valid UTF-8.
+    queue.enqueue(body.decode())
+    return {"status": "queued", "transaction_hash": data.source.transactionHash}
+
+
+async def process_webhook(ledger: CreditLedger, body: str) -> Dict[str, Any]:
+    """Credit the payment of a verified webhook, retries are credited once"""
+    data = ThirdwebWebhookPayload.model_validate_json(body).buy_with_crypto_status
+    if data is None:
+        return {"status": "ignored", "reason": "Unsupported webhook type"}
+
     if data.destination is None:
         return {"status": "ignored", "reason": "No destination"}
 
@@ -173,56 +160,58 @@ async def thirdweb_webhook(
             "reason": "Transaction not for Bedrock payment address",
         }
 
-    try:
-        # Extract transaction details
-        transaction_hash = data.source.transactionHash
-        sender_address = Web3.to_checksum_address(data.purchaseData.userAddress)
+    # Extract transaction details
+    transaction_hash = data.source.transactionHash
+    sender_address = Web3.to_checksum_address(data.purchaseData.userAddress)
 
-        # Convert amount from cents to dollars
-        amount_usd = data.destination.amountUSDCents / 100
+    # Convert amount from cents to dollars
+    amount_usd = data.destination.amountUSDCents / 100
 
-        # Only process completed transactions
-        if data.status == "COMPLETED":
-            # Update credit balance on Aleph
-            await update_credit_balance(sender_address, amount_usd)
-
-            return {
-                "status": "success",
-                "transaction_hash": transaction_hash,
-                "address": sender_address,
-                "amount": amount_usd,
-            }
-        else:
+    # Only process completed transactions
+    if data.status == "COMPLETED":
+        # Recorded now, published to Aleph with the next snapshot. Retries of
+        # a webhook already credited are acknowledged without crediting.
+        if not ledger.credit(transaction_hash.lower(), sender_address, amount_usd):
             return {
-                "status": "pending",
+                "status": "ignored",
+                "reason": "Transaction already credited",
                 "transaction_hash": transaction_hash,
-                "address": sender_address,
-                "amount": amount_usd,
             }
 
-    except Exception as e:
-        raise HTTPException(
-            status_code=500, detail=f"Error processing webhook: {str(e)}"
-        )
+        return {
+            "status": "success",
+            "transaction_hash": transaction_hash,
+            "address": sender_address,
+            "amount": amount_usd,
+        }
+    else:
+        return {
+            "status": "pending",
+            "transaction_hash": transaction_hash,
+            "address": sender_address,
+            "amount": amount_usd,
+        }
 
 
 # Credits endpoint
-async def get_credits(address: str) -> Dict[str, Any]:
+async def get_credits(ledger: CreditLedger, address: str) -> Dict[str, Any]:
     """Get credit balance for an address"""
     try:
         checksum_address = Web3.to_checksum_address(address)
-        balance = await get_credit_balance(checksum_address)
+        balance = await ledger.balance(checksum_address)
         return {"address": checksum_address, "balance": balance}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error getting credits: {str(e)}")
 
 
-async def add_credits_direct(address: str, amount: float) -> Dict[str, Any]:
+async def add_credits_direct(
+    ledger: CreditLedger, address: str, amount: float
+) -> Dict[str, Any]:
     """Add credits directly to an address balance"""
     try:
         checksum_address = Web3.to_checksum_address(address)
-        await update_credit_balance(checksum_address, amount)
-        new_balance = await get_credit_balance(checksum_address)
+        ledger.credit(f"direct:{uuid.uuid4().hex}", checksum_address, amount)
+        new_balance = await ledger.balance(checksum_address)
         return {
             "address": checksum_address,
             "amount_added": amount,
@@ -230,3 +219,45 @@ async def add_credits_direct(address: str, amount: float) -> Dict[str, Any]:
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error adding credits: {str(e)}")
+
+
+async def get_credits_many(
+    ledger: CreditLedger, addresses: list[str]
+) -> Dict[str, float]:
+    """Get the credit balances of many addresses, by checksum address"""
+    try:
+        checksum_addresses = list(
+            dict.fromkeys(Web3.to_checksum_address(a) for a in addresses)
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid address: {str(e)}")
+    try:
+        return await ledger.balances(checksum_addresses)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error getting credits: {str(e)}")
+
+
+async def add_credits_bulk(
+    ledger: CreditLedger, grants: list[tuple[str, float]]
+) -> Dict[str, float]:
+    """
+    Add credits to many addresses at once, all of them or none. Returns the
+    amount added to each checksum address, the new balances are published to
+    Aleph together.
+    """
+    try:
+        credits = [
+            (f"direct:{uuid.uuid4().hex}", Web3.to_checksum_address(address), amount)
+            for address, amount in grants
+        ]
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid address: {str(e)}")
+    try:
+        await ledger.credit_many_in_thread(credits)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error adding credits: {str(e)}")
+
+    added: Dict[str, float] = {}
+    for _, address, amount in credits:
+        added[address] = added.get(address, 0.0) + amount
+    return added
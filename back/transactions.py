@@ -0,0 +1,229 @@
+import asyncio
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from typing import Any, cast
+
+from eth_account.signers.local import LocalAccount
+from hexbytes import HexBytes
+from web3 import AsyncWeb3
+from web3.contract.async_contract import AsyncContractFunction
+from web3.exceptions import Web3RPCError
+from web3.types import Nonce, Wei
+
+from fees import FeeOracle
+
+# Maximum number of signed transactions sent in a single JSON-RPC batch
+MAX_BATCH_SIZE = 50
+
+# Node error messages meaning our local nonce is out of sync with the chain
+NONCE_ERRORS = (
+    "nonce too low",
+    "nonce too high",
+    "invalid nonce",
+    "replacement transaction underpriced",
+)
+
+
+@dataclass
+class _PendingTransaction:
+    function: AsyncContractFunction
+    gas: int | None
+    future: asyncio.Future = field(
+        default_factory=lambda: asyncio.get_running_loop().create_future()
+    )
+    nonce: int = 0
+    raw_transaction: HexBytes = HexBytes(b"")
+    transaction_hash: HexBytes = HexBytes(b"")
+    retried: bool = False
+
+
+class TransactionSubmitter:
+    """
+    Signs and sends transactions for the backend signer account.
+
+    The account nonce is owned in process: it is fetched from the node once, then
+    incremented locally for every transaction, so concurrent callers never share a
+    nonce. The chain id is fetched once, fees and gas limits come from the fee oracle.
+
+    Signed transactions are queued in nonce order and a single sender task
+    pipelines them to the node, sending everything queued in one JSON-RPC batch.
+    When the node rejects a transaction, its nonce is left unused: the local nonce
+    is resynced from the node and the transactions queued behind it are re-signed,
+    so that they do not wait forever behind the gap. A transaction rejected because
+    of its nonce is also re-signed and sent once more.
+    """
+
+    def __init__(
+        self,
+        w3: AsyncWeb3,
+        account: LocalAccount,
+        fee_oracle: FeeOracle,
+        on_sent: Callable[[HexBytes, int, str], None] | None = None,
+    ) -> None:
+        self.w3 = w3
+        self.account = account
+        self.fee_oracle = fee_oracle
+        # Called with the hash, nonce and method name of every transaction sent
+        self.on_sent = on_sent
+        self._lock = asyncio.Lock()
+        self._queue: asyncio.Queue[_PendingTransaction] = asyncio.Queue()
+        self._nonce: int | None = None
+        self._chain_id: int | None = None
+        self._sender: asyncio.Task | None = None
+
+    def start(self) -> None:
+        """Start the sender task, must be called from the running event loop"""
+        if self._sender is None:
+            # The queue and lock are bound to the event loop they are first used in
+            self._lock = asyncio.Lock()
+            self._queue = asyncio.Queue()
+            self._sender = asyncio.create_task(self._send_loop())
+
+    async def stop(self) -> None:
+        if self._sender is not None:
+            self._sender.cancel()
+            try:
+                await self._sender
+            except asyncio.CancelledError:
+                pass
+            self._sender = None
+
+    async def submit(
+        self, function: AsyncContractFunction, gas: int | None = None
+    ) -> HexBytes:
+        """Sign and queue a contract call, returning its transaction hash once sent"""
+        pending = _PendingTransaction(function=function, gas=gas)
+        await self._sign_and_enqueue(pending)
+        return await pending.future
+
+    async def resync_nonce(self) -> None:
+        """Forget the local nonce, the next transaction will fetch it from the node"""
+        async with self._lock:
+            self._nonce = None
+
+    async def _sign_and_enqueue(self, pending: _PendingTransaction) -> None:
+        # Nonce allocation and enqueueing happen under the same lock so that the
+        # queue is always in nonce order
+        async with self._lock:
+            try:
+                if self._chain_id is None:
+                    self._chain_id = await self.w3.eth.chain_id
+                if self._nonce is None:
+                    self._nonce = await self.w3.eth.get_transaction_count(
+                        self.account.address, "pending"
+                    )
+
+                gas = pending.gas or self.fee_oracle.gas_limit(pending.function.fn_name)
+                fees = await self.fee_oracle.fees()
+                txn = await pending.function.build_transaction(
+                    {
+                        "from": self.account.address,
+                        "nonce": Nonce(self._nonce),
+                        "gas": gas,
+                        "maxFeePerGas": Wei(fees["maxFeePerGas"]),
+                        "maxPriorityFeePerGas": Wei(fees["maxPriorityFeePerGas"]),
+                        "chainId": self._chain_id,
+                    }
+                )
+                signed_txn = self.account.sign_transaction(cast(dict[str, Any], txn))
+            except Exception as e:
+                if not pending.future.done():
+                    pending.future.set_exception(e)
+                return
+
+            pending.nonce = self._nonce
+            self._nonce += 1
+            pending.raw_transaction = signed_txn.raw_transaction
+            pending.transaction_hash = signed_txn.hash
+            self._queue.put_nowait(pending)
+
+    async def _send_loop(self) -> None:
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < MAX_BATCH_SIZE and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            await self._send_batch(batch)
+
+    async def _send_batch(self, batch: list[_PendingTransaction]) -> None:
+        try:
+            responses: Any = await self.w3.provider.make_batch_request(
+                [
+                    ("eth_sendRawTransaction", [pending.raw_transaction.to_0x_hex()])
+                    for pending in batch
+                ]
+            )
+        except Exception as e:
+            # We don't know which transactions reached the node, start over from
+            # its view
+            for pending in batch:
+                if not pending.future.done():
+                    pending.future.set_exception(e)
+            await self._resign_from(batch[0].nonce, [])
+            return
+
+        if not isinstance(responses, list):
+            # The whole batch was rejected with a single error
+            responses = [responses] * len(batch)
+
+        to_retry = []
+        rejected = []
+        for pending, response in zip(batch, responses):
+            error = response.get("error")
+            if error is None:
+                self._sent(pending)
+                continue
+
+            message = (
+                str(error.get("message", error))
+                if isinstance(error, dict)
+                else str(error)
+            )
+            if "already known" in message:
+                # The node already has this exact transaction
+                self._sent(pending)
+            elif not pending.retried and any(
+                e in message.lower() for e in NONCE_ERRORS
+            ):
+                pending.retried = True
+                to_retry.append(pending)
+            else:
+                rejected.append(pending)
+                if not pending.future.done():
+                    pending.future.set_exception(
+                        Web3RPCError(message, rpc_response=response)
+                    )
+
+        if to_retry or rejected:
+            await self._resign_from(
+                min(pending.nonce for pending in to_retry + rejected), to_retry
+            )
+
+    async def _resign_from(
+        self, nonce: int, to_retry: list[_PendingTransaction]
+    ) -> None:
+        """
+        Resync the nonce after transactions were rejected from `nonce` on, then sign
+        again the ones to retry and the queued ones that were given a nonce since
+        """
+        await self.resync_nonce()
+        queued = []
+        while not self._queue.empty():
+            queued.append(self._queue.get_nowait())
+        for pending in queued:
+            if pending.nonce < nonce:
+                # Sent before the rejected ones, nothing to fix
+                self._queue.put_nowait(pending)
+        for pending in sorted(
+            to_retry + [pending for pending in queued if pending.nonce >= nonce],
+            key=lambda pending: pending.nonce,
+        ):
+            await self._sign_and_enqueue(pending)
+
+    def _sent(self, pending: _PendingTransaction) -> None:
+        if self.on_sent is not None:
+            self.on_sent(
+                pending.transaction_hash, pending.nonce, pending.function.fn_name
+            )
+        # The caller may have gone away in the meantime
+        if not pending.future.done():
+            pending.future.set_result(pending.transaction_hash)
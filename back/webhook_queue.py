@@ -0,0 +1,175 @@
+import asyncio
+import os
+import sqlite3
+import time
+from collections.abc import Awaitable, Callable
+from typing import Any
+
+from metrics import webhook_events
+
+# Number of webhooks processed at the same time
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "4"))
+
+# A failed webhook is retried after WEBHOOK_RETRY_DELAY seconds, twice as long
+# after every new failure up to WEBHOOK_MAX_RETRY_DELAY, and moved to the dead
+# letters after WEBHOOK_MAX_ATTEMPTS attempts
+WEBHOOK_RETRY_DELAY = 1.0
+WEBHOOK_MAX_RETRY_DELAY = 300.0
+WEBHOOK_MAX_ATTEMPTS = 10
+
+# Delay between two looks for webhooks due for a retry (seconds)
+WEBHOOK_POLL_INTERVAL = 1.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS webhook_queue (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    payload TEXT NOT NULL,
+    received REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL,
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS webhook_queue_next_attempt
+    ON webhook_queue (next_attempt);
+CREATE TABLE IF NOT EXISTS webhook_dead_letters (
+    id INTEGER PRIMARY KEY,
+    payload TEXT NOT NULL,
+    received REAL NOT NULL,
+    attempts INTEGER NOT NULL,
+    failed REAL NOT NULL,
+    error TEXT NOT NULL
+);
+"""
+
+
+class WebhookQueue:
+    """
+    Webhooks acknowledged once stored in SQLite, then processed in the background.
+
+    A pool of WEBHOOK_WORKERS tasks hands every stored webhook to `handler`. A
+    webhook is removed once handled; when the handler raises it is retried with
+    an exponential backoff, and moved to the dead letters after
+    WEBHOOK_MAX_ATTEMPTS attempts. Webhooks being processed when the application
+    stops are processed again when it starts, the handler must be idempotent.
+    """
+
+    def __init__(
+        self, conn: sqlite3.Connection, handler: Callable[[str], Awaitable[Any]]
+    ) -> None:
+        self.conn = conn
+        # A webhook must not be lost once acknowledged, even by a power failure
+        self.conn.execute("PRAGMA synchronous=FULL")
+        self.conn.executescript(SCHEMA)
+        self.handler = handler
+        self._items: asyncio.Queue[tuple[int, str, int, float]] = asyncio.Queue(
+            maxsize=WEBHOOK_WORKERS
+        )
+        # Webhooks handed to a worker and not finished yet
+        self._in_flight: set[int] = set()
+        self._wake = asyncio.Event()
+        self._tasks: list[asyncio.Task] = []
+
+    def start(self) -> None:
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._dispatch())] + [
+                asyncio.create_task(self._work()) for _ in range(WEBHOOK_WORKERS)
+            ]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+
+    @property
+    def running(self) -> bool:
+        """Whether workers are up to process the webhooks enqueued now"""
+        return bool(self._tasks) and not any(task.done() for task in self._tasks)
+
+    def enqueue(self, payload: str) -> int:
+        """Store a webhook for processing, it is durable once this returns"""
+        now = time.time()
+        with self.conn:
+            cursor = self.conn.execute(
+                "INSERT INTO webhook_queue (payload, received, next_attempt) "
+                "VALUES (?, ?, ?)",
+                (payload, now, now),
+            )
+        self._wake.set()
+        return cursor.lastrowid  # type: ignore[return-value]
+
+    def stats(self) -> dict[str, int]:
+        (queued,) = self.conn.execute("SELECT COUNT(*) FROM webhook_queue").fetchone()
+        (dead,) = self.conn.execute(
+            "SELECT COUNT(*) FROM webhook_dead_letters"
+        ).fetchone()
+        return {"queued": queued, "in_flight": len(self._in_flight), "dead": dead}
+
+    async def _dispatch(self) -> None:
+        while True:
+            self._wake.clear()
+            rows = self.conn.execute(
+                "SELECT id, payload, attempts, received FROM webhook_queue "
+                "WHERE next_attempt <= ? ORDER BY next_attempt LIMIT ?",
+                (time.time(), len(self._in_flight) + WEBHOOK_WORKERS),
+            ).fetchall()
+            for row in rows:
+                if row[0] not in self._in_flight:
+                    self._in_flight.add(row[0])
+                    await self._items.put(row)
+            try:
+                await asyncio.wait_for(self._wake.wait(), WEBHOOK_POLL_INTERVAL)
+            except TimeoutError:
+                pass
+
+    async def _work(self) -> None:
+        while True:
+            webhook_id, payload, attempts, received = await self._items.get()
+            try:
+                await self.handler(payload)
+            except Exception as e:
+                self._failed(webhook_id, payload, attempts + 1, received, e)
+            else:
+                with self.conn:
+                    self.conn.execute(
+                        "DELETE FROM webhook_queue WHERE id = ?", (webhook_id,)
+                    )
+                webhook_events.inc(("processed",))
+            finally:
+                self._in_flight.discard(webhook_id)
+                self._wake.set()
+
+    def _failed(
+        self,
+        webhook_id: int,
+        payload: str,
+        attempts: int,
+        received: float,
+        error: Exception,
+    ) -> None:
+        print(f"Error processing webhook {webhook_id} (attempt {attempts}): {error}")
+        with self.conn:
+            if attempts >= WEBHOOK_MAX_ATTEMPTS:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO webhook_dead_letters "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (webhook_id, payload, received, attempts, time.time(), str(error)),
+                )
+                self.conn.execute(
+                    "DELETE FROM webhook_queue WHERE id = ?", (webhook_id,)
+                )
+                webhook_events.inc(("dead_lettered",))
+                return
+            delay = min(
+                WEBHOOK_RETRY_DELAY * 2 ** (attempts - 1), WEBHOOK_MAX_RETRY_DELAY
+            )
+            self.conn.execute(
+                "UPDATE webhook_queue SET attempts = ?, next_attempt = ?, "
+                "last_error = ? WHERE id = ?",
+                (attempts, time.time() + delay, str(error), webhook_id),
+            )
+            webhook_events.inc(("retried",))